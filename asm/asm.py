@@ -13,9 +13,12 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+#  EXPORT Label1   ; let other modules use Label1 when linked (link.py)
 
 import sys
 import re
+import struct
 
 # Opcodes
 OPCODES = {
@@ -52,23 +55,54 @@ OPCODES = {
     "SHR":  {"type": 2, "code": "10101101"},
     "ST":   {"type": 2, "code": "10000100"},
     "SUB":  {"type": 2, "code": "10100001"},
+    # Test-and-set, only on multicore machines (ls8/multicore.py)
+    "TAS":  {"type": 2, "code": "10000101"},
     "XOR":  {"type": 2, "code": "10101011"},
 }
 
+# Binary image format (see ls8/cpu.py): magic, version, load address, entry
+# point, pad byte, code length, symbol table length, then the code and the
+# symbol table as (address, name length, name) records
+IMAGE_MAGIC = b'LS8B'
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct('<4sBBBxHH')
+
+# Object module format (see write_object): magic, version, pad byte, code
+# length, symbol count, relocation count
+OBJECT_MAGIC = b'LS8O'
+OBJECT_VERSION = 1
+OBJECT_HEADER = struct.Struct('<4sBxHHH')
+
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+REGEX = re.compile(r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?")
 
 # Regex for capturing DS and DB data
-REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
-REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
+REGEX_DS = re.compile(r"(?:(\w+?):)?\s*DS\s*(.+)", re.IGNORECASE)
+REGEX_DB = re.compile(r"(?:(\w+?):)?\s*DB\s*(.+)", re.IGNORECASE)
+
+# Regex for register operands
+REGEX_REG = re.compile(r"R([0-7])")
+
+# Opcodes as ints, and operand counts by opcode type
+CODES = {opcode: int(info["code"], 2) for opcode, info in OPCODES.items()}
+OPERAND_COUNTS = {0: 0, 1: 1, 2: 2, 8: 2}
 
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-O] [-b | -c] [inputfile] [outputfile]
+
+    -O runs the peephole optimizer (peephole.py) and reports what it
+    saved. -b writes a binary image instead of text, and -c an object
+    module for link.py.
     """
 
+    binary = '-b' in argv[1:]
+    obj = '-c' in argv[1:]
+    optimize = '-O' in argv[1:]
+    argv = [a for a in argv if a not in ('-b', '-c', '-O')]
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,13 +116,14 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-O] [-b | -c] [infile.asm] [outfile.ls8]",
+              file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    return inputfile, outputfile, binary, obj, optimize
 
 
-def open_files(inputfile, outputfile):
+def open_files(inputfile, outputfile, binary=False):
     """
     Open files for reading and writing. If either of the files are named "-",
     stdin or stdout is returned as appropriate.
@@ -100,9 +135,9 @@ def open_files(inputfile, outputfile):
         inputfile = open(inputfile)
 
     if outputfile == "-":
-        outputfile = sys.stdout
+        outputfile = sys.stdout.buffer if binary else sys.stdout
     else:
-        outputfile = open(outputfile, "w")
+        outputfile = open(outputfile, "wb" if binary else "w")
 
     return inputfile, outputfile
 
@@ -127,6 +162,106 @@ def p8(v):
     return "{:08b}".format(v)
 
 
+class Statement:
+    """One parsed source line, from parse()."""
+
+    def __init__(self, line_num, label, opcode, op_a, op_b, args):
+        self.line_num = line_num
+        # Upper-cased label, opcode and operands as written, or None
+        self.label = label
+        self.opcode = opcode
+        self.op_a = op_a
+        self.op_b = op_b
+        # For instructions, the operand values: register numbers, and
+        # LDI's value as an int or a label name. The label for EXPORT,
+        # the text for DS, and (byte, text) for DB.
+        self.args = args
+
+
+def parse(source):
+    """
+    Parse source lines into Statements, one for every line with a label
+    or something to assemble. Raises an exception on errors.
+    """
+
+    def get_reg(op):
+        """Get a register number from a string, e.g. "R2" -> 2"""
+        m = REGEX_REG.match(op)
+        if m is None:
+            raise Exception(f"Line {line_num}: unknown register {op}")
+        return int(m.group(1))
+
+    for line_num, line in enumerate(source, 1):
+        # Strip comments
+        comment_index = line.find(';')
+        if comment_index != -1:
+            line = line[:comment_index]
+
+        # Normalize
+        line = line.strip()
+
+        # Ignore blank lines
+        if not line:
+            continue
+
+        label, opcode, op_a, op_b = normalize_line(REGEX.match(line).groups())
+        args = None
+
+        if opcode == 'EXPORT':
+            if op_a is None:
+                raise Exception(f"Line {line_num}: missing label to EXPORT")
+            args = op_a
+
+        elif opcode == 'DS':
+            m = REGEX_DS.match(line)
+            if m is None or m.group(2) is None:
+                raise Exception(f"Line {line_num}: missing argument to DS")
+            args = m.group(2)
+
+        elif opcode == 'DB':
+            m = REGEX_DB.match(line)
+            if m is None or m.group(2) is None:
+                raise Exception(f"Line {line_num}: missing argument to DB")
+            data = m.group(2)
+            try:
+                # Force to byte size
+                args = (int(data, 0) & 0xff, data)
+            except ValueError:
+                raise Exception(
+                    f"Line {line_num}: invalid integer argument to DB")
+
+        elif opcode is not None:
+            # Make sure we know this opcode at all
+            if opcode not in OPCODES:
+                raise Exception(f"Line {line_num}: unknown opcode {opcode}")
+
+            # Check operand count
+            op_type = OPCODES[opcode]["type"]
+            desired = OPERAND_COUNTS[op_type]
+            found = (op_a is not None) + (op_b is not None)
+            if found < desired:
+                raise Exception(
+                    f"Line {line_num}: missing operand to {opcode}")
+            elif found > desired:
+                raise Exception(
+                    f"Line {line_num}: unexpected operand to {opcode}")
+
+            args = []
+            if op_type >= 1:
+                args.append(get_reg(op_a))
+            if op_type == 2:
+                args.append(get_reg(op_b))
+            elif op_type == 8:
+                # LDI r,i or LDI r,label
+                try:
+                    args.append(int(op_b, 0))
+                except ValueError:
+                    # If it's not a value, it might be a symbol
+                    args.append(op_b)
+
+        yield Statement(line_num, label, opcode, op_a, op_b, args)
+
+
 def pass1(inputfile, sym, code):
     """
     Pass 1
@@ -137,256 +272,316 @@ def pass1(inputfile, sym, code):
     * Emit machine code
     """
 
-    # Source line number
-    line_num = 0
-
     # Current code address (for labels)
     addr = 0
 
-    def get_reg(op, fatal=True):
-        """Get a register number from a string, e.g. "R2" -> 2"""
-
-        nonlocal line_num
-
-        m = re.match(r"R([0-7])", op)
+    try:
+        for st in parse(inputfile):
+            opcode = st.opcode
 
-        if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                      file=sys.stderr)
-                sys.exit(1)
+            # Track label address
+            if st.label is not None:
+                sym[st.label] = addr
+                code.append(f'# {st.label} (address {addr}):')
+
+            if opcode is None or opcode == 'EXPORT':
+                # EXPORT only matters to the linker
+                continue
+
+            if opcode == 'DS':
+                for c in st.args:
+                    print_char = '[space]' if c == ' ' else c
+                    code.append(f"{p8(ord(c))} # {print_char}")
+                addr += len(st.args)
+                continue
+
+            if opcode == 'DB':
+                val, data = st.args
+                code.append(f"{p8(val)} # {data}")
+                addr += 1
+                continue
+
+            machine_code = OPCODES[opcode]["code"]
+            op_type = OPCODES[opcode]["type"]
+
+            if op_type == 0:
+                code.append(f"{machine_code} # {opcode}")
+            elif op_type == 1:
+                code.append(f"{machine_code} # {opcode} {st.op_a}")
             else:
-                return None
-
-        return int(m.group(1))
-
-    def out0(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with zero operands"""
-
-        nonlocal addr
-
-        code.append(f"{machine_code} # {opcode}")
-        addr += 1
+                code.append(f"{machine_code} # {opcode} {st.op_a},{st.op_b}")
 
-    def out1(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with one operand"""
+            for arg in st.args:
+                code.append(f"sym:{arg}" if isinstance(arg, str) else p8(arg))
 
-        nonlocal addr
+            addr += 1 + len(st.args)
 
-        reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
-        addr += 2
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
 
-    def out2(opcode, op_a, op_b, machine_code):
-        """Handle opcodes with two operands"""
 
-        nonlocal addr
+def pass2(outputfile, sym, code):
+    """
+    Output the code, substituting in any symbols.
+    """
 
-        reg_a = get_reg(op_a)
-        reg_b = get_reg(op_b)
+    for c in code:
+        # Replace symbols
+        if c[:4] == 'sym:':
+            s = c[4:].strip()
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+            if s in sym:
+                c = p8(sym[s])
 
-        addr += 3
+            else:
+                print(f"unknown symbol: {s}", file=sys.stderr)
+                sys.exit(2)
 
-    def out8(opcode, op_a, op_b, machine_code):
-        """Handle LDI opcode (type 8)"""
+        outputfile.write(f"{c}\n")
 
-        nonlocal addr
 
-        reg_a = get_reg(op_a)
+def pass2_binary(outputfile, sym, code):
+    """
+    Output the code as a binary image, substituting in any symbols and
+    appending the symbol table.
+    """
 
-        try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+    image = bytearray()
 
-        except ValueError:
-            # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+    for c in code:
+        # Skip label comments
+        if c[:1] == '#':
+            continue
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
+        # Replace symbols
+        if c[:4] == 'sym:':
+            s = c[4:].strip()
 
-        addr += 3
+            if s in sym and sym[s] > 0xff:
+                print(f"{s} is at address {sym[s]}, past the end of RAM",
+                      file=sys.stderr)
+                sys.exit(2)
+            elif s in sym:
+                image.append(sym[s])
 
-    def handle_ds(line):
-        """
-        Handle DS pseudo-opcode
-        """
+            else:
+                print(f"unknown symbol: {s}", file=sys.stderr)
+                sys.exit(2)
 
-        nonlocal addr
+        else:
+            image.append(int(c.split('#', 1)[0], 2))
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+    write_image(outputfile, image, sym)
 
-        if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
 
-        data = m.group(2)
+def write_image(outputfile, image, sym):
+    """Write machine code and its symbol table as a binary image."""
 
-        for i in range(len(data)):
-            print_char = data[i]
+    symtab = bytearray()
 
-            if print_char == ' ':
-                print_char = '[space]'
+    for name, addr in sym.items():
+        # A label just past the last byte of a program that fills RAM
+        # has no address to record
+        if addr > 0xff:
+            continue
+        name = name.encode()
+        symtab += bytes((addr, len(name))) + name
 
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
+    outputfile.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, 0,
+                                       len(image), len(symtab)))
+    outputfile.write(image)
+    outputfile.write(symtab)
 
-        addr += len(data)
 
-    def handle_db(line):
-        """
-        Handle the DB pseudo-opcode
-        """
+class ObjectModule:
+    """
+    An assembled module, before linking: its code with label references
+    left as 0, and what's needed to place it and fill them in.
+    """
 
-        nonlocal addr
+    def __init__(self, code, symbols, exports, relocations, line_map):
+        self.code = code
+        # Label offsets within the module, by (upper-cased) name
+        self.symbols = symbols
+        # Labels other modules may refer to
+        self.exports = exports
+        # (offset, label, source line number) of every byte that holds a
+        # label's address
+        self.relocations = relocations
+        # Source line number of every instruction and data item by offset
+        self.line_map = line_map
+
+    def imports(self):
+        """Labels this module refers to but doesn't define."""
+        return {s for offset, s, line_num in self.relocations
+                if s not in self.symbols}
+
+
+def assemble_object(source):
+    """
+    Assemble source, a string or a list of lines, into an ObjectModule.
+    Labels it refers to but doesn't define are imports, for the linker to
+    find in other modules; EXPORT label makes a label visible to them.
+    Raises an exception on errors.
+    """
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+    if isinstance(source, str):
+        source = source.splitlines()
 
-        if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+    code = bytearray()
+    sym = {}
+    exports = set()
+    relocations = []
+    line_map = {}
 
-        data = m.group(2)
+    for st in parse(source):
+        if st.label is not None:
+            sym[st.label] = len(code)
 
-        try:
-            val = int(data, 0)
+        if st.opcode is None:
+            continue
 
-        except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                  file=sys.stderr)
-            sys.exit(2)
+        if st.opcode == 'EXPORT':
+            exports.add(st.args)
+            continue
 
-        # Force to byte size
-        val &= 0xff
+        line_map[len(code)] = st.line_num
 
-        code.append(f"{p8(val)} # {data}")
+        if st.opcode == 'DS':
+            code += bytes(ord(c) & 0xff for c in st.args)
 
-        addr += 1
+        elif st.opcode == 'DB':
+            code.append(st.args[0])
 
-    def check_ops(opcode, op_a, op_b):
-        """Check operands for sanity with a particular opcode"""
+        else:
+            code.append(CODES[st.opcode])
+            for arg in st.args:
+                if isinstance(arg, str):
+                    # A label, filled in when linked
+                    relocations.append((len(code), arg, st.line_num))
+                    code.append(0)
+                else:
+                    code.append(arg & 0xff)
 
-        def check_ops_count(desired, found):
-            # Makes sure we have right operand count
-            if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
-            elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+    for s in exports:
+        if s not in sym:
+            raise Exception(f"EXPORT of unknown label {s}")
 
-        # Make sure we know this opcode at all
-        if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+    return ObjectModule(code, sym, exports, relocations, line_map)
 
-        op_type = OPCODES[opcode]["type"]
 
-        total_operands = 0
+def assemble(source):
+    """
+    Assemble source, a string or a list of lines, straight to machine
+    code, for programs that generate and run code without files.
 
-        if op_a is not None:
-            total_operands += 1
+    Returns (image, symbols, line_map): the code as a bytearray, label
+    addresses by (upper-cased) name, and the source line number of every
+    instruction and data item by address. Raises an exception on errors.
+    """
 
-        if op_b is not None:
-            total_operands += 1
+    module = assemble_object(source)
+    image = module.code
 
-        if op_type == 0 or op_type == 1 or op_type == 2:
-            # 0, 1, or 2 register operands
-            check_ops_count(op_type, total_operands)
+    for address, s, line_num in module.relocations:
+        if s not in module.symbols:
+            raise Exception(f"Line {line_num}: unknown symbol: {s}")
+        if module.symbols[s] > 0xff:
+            raise Exception(f"Line {line_num}: {s} is at address "
+                            f"{module.symbols[s]}, past the end of RAM")
+        image[address] = module.symbols[s]
 
-        elif op_type == 8:
-            # LDI r,i or LDI r,label
-            check_ops_count(2, total_operands)
+    if len(image) > 256:
+        raise Exception(f"Program is {len(image)} bytes, over 256")
 
-    # Type to function mapping
-    type_f = {
-        0: out0,
-        1: out1,
-        2: out2,
-        8: out8,
-    }
+    return image, module.symbols, module.line_map
 
-    for line in inputfile:
-        line_num += 1
 
-        # Strip comments
-        comment_index = line.find(';')
-        if comment_index != -1:
-            line = line[:comment_index]
+def write_object(outputfile, module):
+    """
+    Write an ObjectModule: header, code, then symbol records (offset,
+    exported flag, name length, name) and relocation records (offset,
+    source line, name length, name). Line maps aren't kept.
+    """
 
-        # Normalize
-        line = line.strip()
+    symtab = bytearray()
+    count = 0
 
-        # Ignore blank lines
-        if input == '':
+    for name, addr in module.symbols.items():
+        # As in write_image, an end label at 256 is left out
+        if addr > 0xff:
             continue
+        count += 1
+        exported = 1 if name in module.exports else 0
+        name = name.encode()
+        symtab += bytes((addr, exported, len(name))) + name
 
-        # print(line)  # debug
+    reltab = bytearray()
 
-        m = re.match(REGEX, line)
+    for offset, name, line_num in module.relocations:
+        name = name.encode()
+        reltab += struct.pack('<BHB', offset, line_num, len(name)) + name
 
-        if m is not None:
-            label, opcode, op_a, op_b = normalize_line(m.groups())
+    outputfile.write(OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION,
+                                        len(module.code), count,
+                                        len(module.relocations)))
+    outputfile.write(module.code)
+    outputfile.write(symtab)
+    outputfile.write(reltab)
 
-            # print(label, opcode, op_a, op_b)  # debug
 
-            # Track label address
-            if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
-
-            if opcode is not None:
-                if opcode == 'DS':
-                    handle_ds(line)
-                elif opcode == 'DB':
-                    handle_db(line)
-                else:
-                    # Check operand count
-                    check_ops(opcode, op_a, op_b)
+def read_object(inputfile):
+    """Read an ObjectModule written by write_object()."""
 
-                    # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
-        else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+    data = inputfile.read()
+    (magic, version, length, symbol_count,
+     relocation_count) = OBJECT_HEADER.unpack_from(data)
 
+    if magic != OBJECT_MAGIC or version != OBJECT_VERSION:
+        raise Exception("Not an LS-8 object file, or an unsupported version")
 
-def pass2(outputfile, sym, code):
-    """
-    Output the code, substituting in any symbols.
-    """
+    offset = OBJECT_HEADER.size
+    code = bytearray(data[offset:offset + length])
+    offset += length
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    sym = {}
+    exports = set()
 
-            if s in sym:
-                c = p8(sym[s])
+    for _ in range(symbol_count):
+        addr, exported, name_length = data[offset:offset + 3]
+        name = data[offset + 3:offset + 3 + name_length].decode()
+        sym[name] = addr
+        if exported:
+            exports.add(name)
+        offset += 3 + name_length
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+    relocations = []
 
-        outputfile.write(f"{c}\n")
+    for _ in range(relocation_count):
+        addr, line_num, name_length = struct.unpack_from('<BHB', data, offset)
+        name = data[offset + 4:offset + 4 + name_length].decode()
+        relocations.append((addr, name, line_num))
+        offset += 4 + name_length
+
+    return ObjectModule(code, sym, exports, relocations, {})
 
 
 def main(argv):
     # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    inputfile, outputfile, binary, obj, optimize = parse_commandline(argv)
 
     # Open files
-    inputfile, outputfile = open_files(inputfile, outputfile)
+    inputfile, outputfile = open_files(inputfile, outputfile, binary or obj)
+
+    if obj:
+        try:
+            module = assemble_object(inputfile.read())
+        except Exception as e:
+            print(e, file=sys.stderr)
+            return 2
+        write_object(outputfile, module)
+        return 0
 
     # Set up the symbol table
     sym = {}
@@ -396,7 +591,23 @@ def main(argv):
 
     # Assemble
     pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+
+    if optimize:
+        import peephole
+        code, sym, stats = peephole.optimize(code)
+        print(f"-O: {stats['bytes']} bytes smaller; "
+              f"{stats['removed']} instructions removed, "
+              f"{stats['hoisted']} hoisted out of loops, "
+              f"{stats['threaded']} jumps threaded, "
+              f"{stats['reduced']} MULs strength-reduced; about "
+              f"{stats['removed']} cycles saved per pass through the code "
+              f"and {stats['hoisted']} per loop iteration",
+              file=sys.stderr)
+
+    if binary:
+        pass2_binary(outputfile, sym, code)
+    else:
+        pass2(outputfile, sym, code)
 
     return 0
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# Incremental build of every .asm source into .ls8 files
+#
+# Each output is keyed on a hash of its source and of the assembler, and
+# rebuilt only when the key changes or the output is missing. The keys
+# live in a manifest in the output directory, along with each source's
+# size and modification time, so an unchanged source isn't even read.
+# Stale sources are assembled across a process pool, and every output is
+# written to a temporary file and renamed into place, so an interrupted
+# build never leaves a half-written program.
+
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os.path import abspath, dirname, join
+
+import asm
+
+HERE = dirname(abspath(__file__))
+MANIFEST = '.asmbuild.json'
+
+# Fewer stale sources than this are assembled in this process; starting
+# a pool would take longer
+POOL_THRESHOLD = 16
+
+
+def parse_commandline(argv):
+    """
+    Usage: build.py [--force] [--jobs=N] [sourcedir] [outputdir]
+
+    Defaults to the .asm files here and ../ls8/examples. --force
+    rebuilds everything.
+    """
+
+    options = {}
+    args = []
+
+    for arg in argv[1:]:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            options[key] = value
+        else:
+            args.append(arg)
+
+    if len(args) > 2:
+        print("usage: build.py [--force] [--jobs=N] [sourcedir] [outputdir]",
+              file=sys.stderr)
+        sys.exit(1)
+
+    sourcedir = args[0] if args else HERE
+    outputdir = args[1] if len(args) > 1 else join(HERE, '..', 'ls8',
+                                                   'examples')
+    jobs = int(options['jobs']) if options.get('jobs') else None
+
+    return sourcedir, outputdir, 'force' in options, jobs
+
+
+def assembler_key():
+    """Hash of the assembler itself, so a new version rebuilds everything."""
+
+    with open(asm.__file__, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def source_key(source, version):
+    return hashlib.blake2b(version.encode() + source,
+                           digest_size=16).hexdigest()
+
+
+def load_manifest(path, version):
+    """
+    {source name: [size, mtime_ns, key]} from the last build, or empty if
+    there wasn't one or it was by another version of the assembler.
+    """
+
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('version') != version:
+        return {}
+    return manifest['sources']
+
+
+def write_atomic(path, data):
+    """Write data to path through a temporary file and a rename."""
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_one(job):
+    """
+    Assemble one source into its output. Returns (name, error), with
+    error None on success.
+    """
+
+    source_path, output_path, name = job
+
+    sym = {}
+    code = []
+    out = io.StringIO()
+
+    try:
+        with open(source_path) as f:
+            asm.pass1(f, sym, code)
+        asm.pass2(out, sym, code)
+    except SystemExit:
+        # asm has already said what was wrong
+        return name, "assembly failed"
+
+    write_atomic(output_path, out.getvalue())
+    return name, None
+
+
+def build(sourcedir, outputdir, force=False, jobs=None):
+    """
+    Bring every output in outputdir up to date with the sources in
+    sourcedir. Returns (built, up to date, failed) lists of source names.
+    """
+
+    manifest_path = join(outputdir, MANIFEST)
+    version = assembler_key()
+    old = {} if force else load_manifest(manifest_path, version)
+    sources = {}
+    stale = []
+    current = []
+
+    # One listing rather than a stat per output
+    outputs = {entry.name for entry in os.scandir(outputdir)}
+
+    for entry in os.scandir(sourcedir):
+        name = entry.name
+        if not name.endswith('.asm'):
+            continue
+
+        output = name[:-4] + '.ls8'
+        stat = entry.stat()
+        known = old.get(name)
+
+        if known and known[0] == stat.st_size and \
+                known[1] == stat.st_mtime_ns:
+            # Untouched since the last build, so the key is the same
+            key = known[2]
+        else:
+            with open(entry.path, 'rb') as f:
+                key = source_key(f.read(), version)
+
+        sources[name] = [stat.st_size, stat.st_mtime_ns, key]
+        if known and known[2] == key and output in outputs:
+            current.append(name)
+        else:
+            stale.append((entry.path, join(outputdir, output), name))
+
+    if len(stale) < POOL_THRESHOLD or jobs == 1:
+        results = list(map(build_one, stale))
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(build_one, stale, chunksize=32))
+
+    built = []
+    failed = []
+
+    for name, error in results:
+        if error is None:
+            built.append(name)
+        else:
+            failed.append(name)
+            # Build it again next time
+            del sources[name]
+
+    if sources != old:
+        write_atomic(manifest_path,
+                     json.dumps({'version': version, 'sources': sources}))
+
+    return built, current, failed
+
+
+def main(argv):
+    sourcedir, outputdir, force, jobs = parse_commandline(argv)
+
+    start = time.perf_counter()
+    built, current, failed = build(sourcedir, outputdir, force, jobs)
+    elapsed = time.perf_counter() - start
+
+    for name in sorted(failed):
+        print(f"failed: {name}", file=sys.stderr)
+
+    print(f"{len(built)} built, {len(current)} up to date, "
+          f"{len(failed)} failed in {elapsed * 1000:.1f} ms")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
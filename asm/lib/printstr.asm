@@ -0,0 +1,35 @@
+; Library: PrintStr
+;
+; Link a program that calls PrintStr with this module:
+;
+;   python link.py program.ls8 program.asm lib/printstr.asm
+;
+; R0 the address of the string
+; R1 the number of bytes to print
+;
+; Uses R2 and R3.
+
+	EXPORT PrintStr
+
+PrintStr:
+
+	LDI R2,0            ; SAVE 0 into R2 for later CMP
+
+PrintStrLoop:
+
+	CMP R1,R2           ; Compare R1 to 0 (in R2)
+	LDI R3,PrintStrEnd  ; Jump to end if we're done
+	JEQ R3
+
+	LD R3,R0            ; Load R3 from address in R0
+	PRA R3              ; Print character
+
+	INC R0              ; Increment pointer to next character
+	DEC R1              ; Decrement number of characters
+
+	LDI R3,PrintStrLoop ; Keep processing
+	JMP R3
+
+PrintStrEnd:
+
+	RET                 ; Return to caller
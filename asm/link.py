@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Linker for LS-8 object modules
+#
+# Combines modules into one program: the first module goes at address 0,
+# where execution starts, and the rest follow it in order. Each module's
+# label references are filled in from its own labels first, then from the
+# labels the other modules EXPORT.
+#
+# Modules can be object files from asm.py -c, or .asm sources. Sources
+# are assembled through a cache of object files keyed on their contents
+# and the assembler version, so a library is only reassembled when it
+# changes.
+
+import io
+import os
+import sys
+from os.path import abspath, dirname, join
+
+import asm
+from build import assembler_key, source_key, write_atomic
+
+CACHE_DIR = join(dirname(abspath(__file__)), '__objcache__')
+
+
+def parse_commandline(argv):
+    """
+    Usage: link.py [-b] outputfile module ...
+
+    -b writes a binary image instead of text.
+    """
+
+    binary = '-b' in argv[1:]
+    argv = [a for a in argv if a != '-b']
+
+    if len(argv) < 3:
+        print("usage: link.py [-b] outfile.ls8 module.asm|module.o ...",
+              file=sys.stderr)
+        sys.exit(1)
+
+    return argv[1], argv[2:], binary
+
+
+def load_module(path, version=None):
+    """
+    Read an object file, or assemble an .asm source through the object
+    cache.
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data.startswith(asm.OBJECT_MAGIC):
+        return asm.read_object(io.BytesIO(data))
+
+    key = source_key(data, version or assembler_key())
+    cached = join(CACHE_DIR, f"{key}.o")
+
+    try:
+        with open(cached, 'rb') as f:
+            return asm.read_object(f)
+    except OSError:
+        pass
+
+    try:
+        module = asm.assemble_object(data.decode())
+    except Exception as e:
+        raise Exception(f"{path}: {e}")
+
+    out = io.BytesIO()
+    asm.write_object(out, module)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_atomic(cached, out.getvalue())
+
+    return module
+
+
+def link(modules, names=None):
+    """
+    Place modules one after another from address 0 and fill in their
+    label references. names, for error messages, default to module
+    numbers. Returns (image, symbols): the program as a bytearray, and the
+    address of every exported label.
+    """
+
+    names = names or [f"module {i}" for i in range(len(modules))]
+    bases = []
+    exports = {}
+    owners = {}
+    base = 0
+
+    for module, name in zip(modules, names):
+        bases.append(base)
+
+        for s in module.exports:
+            if s in exports:
+                raise Exception(f"{name}: {s} is already exported by "
+                                f"{owners[s]}")
+            exports[s] = base + module.symbols[s]
+            owners[s] = name
+
+        base += len(module.code)
+
+    if base > 256:
+        raise Exception(f"Linked program is {base} bytes, over 256")
+
+    image = bytearray()
+
+    for module, name, base in zip(modules, names, bases):
+        code = bytearray(module.code)
+
+        for offset, s, line_num in module.relocations:
+            if s in module.symbols:
+                address = base + module.symbols[s]
+            elif s in exports:
+                address = exports[s]
+            else:
+                raise Exception(f"{name} line {line_num}: unknown symbol: {s}")
+            if address > 0xff:
+                raise Exception(f"{name} line {line_num}: {s} is at address "
+                                f"{address}, past the end of RAM")
+            code[offset] = address
+
+        image += code
+
+    return image, exports
+
+
+def main(argv):
+    outputfile, paths, binary = parse_commandline(argv)
+
+    version = assembler_key()
+
+    try:
+        modules = [load_module(path, version) for path in paths]
+        image, symbols = link(modules, paths)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if binary:
+        out = io.BytesIO()
+        asm.write_image(out, image, symbols)
+        write_atomic(outputfile, out.getvalue())
+    else:
+        write_atomic(outputfile, "".join(f"{asm.p8(b)}\n" for b in image))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,381 @@
+# Peephole optimizer for asm.py -O
+#
+# Works on the code list pass1 builds, between pass1 and pass2. The list
+# is parsed back into labels, instructions and data, rewritten, and
+# turned back into a code list with every label at its new address.
+#
+# Rewrites, repeated until none applies:
+#
+#  * LDI of a value the register is already known to hold. Known values
+#    are tracked from LDIs through straight-line code and forgotten at
+#    labels, calls and anything that writes the register.
+#  * MUL by a known 1 (dropped), 2 (ADD r,r) or other power of two, when
+#    another register holds the shift count (SHL).
+#  * PUSH r directly followed by POP r.
+#  * Jumps to jumps: an LDI r,A that feeds a jump, where A is LDI r,B
+#    then JMP r, loads B instead. A conditional jump only gets this when
+#    the register is reloaded right after it, since it now holds B when
+#    the jump isn't taken.
+#  * JMP to the very next instruction.
+#  * LDIs inside a simple loop (one label, entered only by falling into
+#    it, no calls) whose register nothing else in the loop touches first
+#    or writes at all; they move to just before the loop.
+#
+# Every LS-8 instruction takes one cycle in the emulator, so estimated
+# cycles saved are instructions no longer executed.
+
+import asm
+
+# Two-register ALU instructions that write their first operand
+ALU2 = {'ADD', 'SUB', 'MUL', 'DIV', 'MOD', 'AND', 'OR', 'XOR', 'SHL', 'SHR'}
+# One-register ALU instructions
+ALU1 = {'INC', 'DEC', 'NOT'}
+JUMPS = {'JMP', 'JEQ', 'JNE', 'JGT', 'JLT', 'JGE', 'JLE'}
+# Control never falls through these
+ENDS_BLOCK = {'JMP', 'RET', 'IRET', 'HLT'}
+
+# Registers the optimizer never assumes anything about: IS changes when
+# an interrupt is raised, and SP belongs to the stack
+UNTRACKED = {6, 7}
+
+
+class Label:
+    def __init__(self, name):
+        self.name = name
+
+
+class Data:
+    """DS and DB bytes, kept as pass1 wrote them."""
+
+    def __init__(self, line):
+        self.lines = [line]
+
+
+class Inst:
+    """An instruction. b is LDI's value: an int or a label name."""
+
+    def __init__(self, name, a=None, b=None):
+        self.name = name
+        self.a = a
+        self.b = b
+
+    def size(self):
+        return asm.OPERAND_COUNTS[asm.OPCODES[self.name]["type"]] + 1
+
+    def reads(self):
+        if self.name in ALU2 or self.name in ('CMP', 'ST', 'TAS'):
+            return {self.a, self.b}
+        if self.name == 'LD':
+            return {self.b}
+        if self.name in ('LDI', 'POP') or self.a is None:
+            return set()
+        return {self.a}
+
+    def writes(self):
+        if self.name in ALU2 or self.name in ALU1 or \
+                self.name in ('LDI', 'LD', 'POP', 'TAS'):
+            return {self.a}
+        return set()
+
+    def emit(self):
+        code = asm.OPCODES[self.name]["code"]
+        if self.name == 'LDI':
+            if isinstance(self.b, str):
+                b = f"sym:{self.b}"
+                text = self.b
+            else:
+                b = asm.p8(self.b)
+                text = self.text
+            return [f"{code} # LDI R{self.a},{text}", asm.p8(self.a), b]
+        if self.b is not None:
+            return [f"{code} # {self.name} R{self.a},R{self.b}",
+                    asm.p8(self.a), asm.p8(self.b)]
+        if self.a is not None:
+            return [f"{code} # {self.name} R{self.a}", asm.p8(self.a)]
+        return [f"{code} # {self.name}"]
+
+
+def parse(code):
+    """Turn pass1's code list into Labels, Insts and Data."""
+
+    items = []
+    i = 0
+
+    while i < len(code):
+        line = code[i]
+        i += 1
+
+        if line.startswith('# '):
+            items.append(Label(line[2:line.index(' (address')]))
+            continue
+
+        bits, _, comment = line.partition(' # ')
+        words = comment.split(' ', 1)
+        name = words[0]
+
+        if name not in asm.OPCODES or asm.CODES[name] != int(bits, 2):
+            # DS and DB bytes run together
+            if items and isinstance(items[-1], Data):
+                items[-1].lines.append(line)
+            else:
+                items.append(Data(line))
+            continue
+
+        inst = Inst(name)
+        count = asm.OPERAND_COUNTS[asm.OPCODES[name]["type"]]
+        if count >= 1:
+            inst.a = int(code[i], 2)
+        if count == 2:
+            b = code[i + 1]
+            if name != 'LDI':
+                inst.b = int(b, 2)
+            elif b.startswith('sym:'):
+                inst.b = b[4:].strip()
+            else:
+                inst.b = int(b, 2)
+                # As written, for the comment
+                inst.text = words[1].split(',', 1)[1]
+        i += count
+        items.append(inst)
+
+    return items
+
+
+def generate(items):
+    """Turn items back into a code list and a symbol table."""
+
+    code = []
+    sym = {}
+    addr = 0
+
+    for item in items:
+        if isinstance(item, Label):
+            sym[item.name] = addr
+            code.append(f'# {item.name} (address {addr}):')
+        elif isinstance(item, Data):
+            code += item.lines
+            addr += len(item.lines)
+        else:
+            code += item.emit()
+            addr += item.size()
+
+    return code, sym
+
+
+def ldi_value(inst):
+    """The value an LDI loads, as a key for known registers."""
+    return ('sym', inst.b) if isinstance(inst.b, str) else inst.b
+
+
+def forget(known, inst):
+    """Update known register values past inst."""
+
+    if inst.name == 'LDI':
+        if inst.a not in UNTRACKED:
+            known[inst.a] = ldi_value(inst)
+    elif inst.name in ENDS_BLOCK or inst.name in ('CALL', 'INT'):
+        known.clear()
+    else:
+        for r in inst.writes():
+            known.pop(r, None)
+
+
+def simplify(items, stats):
+    """Redundant LDIs, MUL by powers of two and PUSH/POP pairs."""
+
+    out = []
+    known = {}
+
+    for item in items:
+        if not isinstance(item, Inst):
+            known.clear()
+            out.append(item)
+            continue
+
+        if item.name == 'LDI' and known.get(item.a) == ldi_value(item):
+            stats['removed'] += 1
+            continue
+
+        if item.name == 'POP' and out and isinstance(out[-1], Inst) and \
+                out[-1].name == 'PUSH' and out[-1].a == item.a:
+            out.pop()
+            stats['removed'] += 2
+            continue
+
+        if item.name == 'MUL' and isinstance(known.get(item.b), int):
+            value = known[item.b]
+            if value == 1:
+                stats['removed'] += 1
+                continue
+            if value == 2:
+                item = Inst('ADD', item.a, item.a)
+                stats['reduced'] += 1
+            elif value and value & (value - 1) == 0:
+                shift = value.bit_length() - 1
+                counts = [r for r, v in known.items() if v == shift]
+                if counts:
+                    item = Inst('SHL', item.a, counts[0])
+                    stats['reduced'] += 1
+
+        forget(known, item)
+        out.append(item)
+
+    return out
+
+
+def trampoline(items, positions, label):
+    """
+    If label is an LDI r,B then JMP r, return (r, B); otherwise None.
+    positions maps labels to the index of the item after them.
+    """
+
+    i = positions.get(label)
+    if i is None:
+        return None
+
+    while i < len(items) and isinstance(items[i], Label):
+        i += 1
+    if i + 1 >= len(items):
+        return None
+
+    ldi, jump = items[i], items[i + 1]
+    if isinstance(ldi, Inst) and isinstance(jump, Inst) and \
+            ldi.name == 'LDI' and isinstance(ldi.b, str) and \
+            jump.name == 'JMP' and jump.a == ldi.a:
+        return ldi.a, ldi.b
+    return None
+
+
+def thread_jumps(items, stats):
+    """Jumps to jumps, and jumps to the next instruction."""
+
+    positions = {item.name: i + 1 for i, item in enumerate(items)
+                 if isinstance(item, Label)}
+    out = []
+
+    for i, item in enumerate(items):
+        prev = out[-1] if out else None
+        is_jump = isinstance(item, Inst) and \
+            (item.name in JUMPS or item.name == 'CALL')
+        fed = is_jump and isinstance(prev, Inst) and prev.name == 'LDI' and \
+            prev.a == item.a and isinstance(prev.b, str)
+
+        if fed and item.name not in ('JMP', 'CALL'):
+            # Only if the register is reloaded before anything can see it
+            after = items[i + 1] if i + 1 < len(items) else None
+            fed = isinstance(after, Inst) and after.name == 'LDI' and \
+                after.a == item.a
+
+        if fed:
+            target = prev.b
+            seen = {target}
+            while True:
+                hop = trampoline(items, positions, target)
+                if hop is None or hop[0] != item.a or hop[1] in seen:
+                    break
+                target = hop[1]
+                seen.add(target)
+            if target != prev.b:
+                out[-1] = Inst('LDI', prev.a, target)
+                stats['threaded'] += 1
+
+        if fed and item.name == 'JMP':
+            # Straight on to the target anyway?
+            j = i + 1
+            labels = set()
+            while j < len(items) and isinstance(items[j], Label):
+                labels.add(items[j].name)
+                j += 1
+            if out[-1].b in labels:
+                stats['removed'] += 1
+                continue
+
+        out.append(item)
+
+    return out
+
+
+def hoist(items, stats):
+    """Move loop-invariant LDIs out of simple loops."""
+
+    references = {}
+    for i, item in enumerate(items):
+        if isinstance(item, Inst) and item.name == 'LDI' and \
+                isinstance(item.b, str):
+            references.setdefault(item.b, []).append(i)
+
+    for start, label in enumerate(items):
+        if not isinstance(label, Label):
+            continue
+
+        # Find the jump back to the label, through straight-line code
+        known = {}
+        end = None
+        for i in range(start + 1, len(items)):
+            item = items[i]
+            if not isinstance(item, Inst) or \
+                    item.name in ('CALL', 'INT', 'IRET', 'RET', 'HLT'):
+                break
+            if item.name in JUMPS and \
+                    known.get(item.a) == ('sym', label.name):
+                end = i
+                break
+            if item.name == 'JMP':
+                break
+            forget(known, item)
+        if end is None:
+            continue
+
+        # The loop can only be entered by falling into it
+        if any(not start < i < end for i in references[label.name]):
+            continue
+
+        body = items[start + 1:end + 1]
+        hoisted = []
+        exited = False
+        seen = set()
+
+        for item in body:
+            if item.name == 'LDI' and item.a not in UNTRACKED and \
+                    not exited and item.a not in seen and \
+                    sum(item.a in other.writes() for other in body) == 1:
+                hoisted.append(item)
+            seen |= item.reads() | item.writes()
+            exited = exited or item.name in JUMPS
+
+        if hoisted:
+            stats['hoisted'] += len(hoisted)
+            rest = [item for item in body if item not in hoisted]
+            items = (items[:start] + hoisted + [label] + rest +
+                     items[end + 1:])
+            # Indexes have moved; look again from the top
+            return hoist(items, stats)
+
+    return items
+
+
+def optimize(code):
+    """
+    Optimize pass1's code list. Returns (code, sym, stats), with the
+    symbol table rebuilt for the new addresses.
+    """
+
+    items = parse(code)
+    before = sum(len(item.lines) if isinstance(item, Data) else item.size()
+                 for item in items if not isinstance(item, Label))
+    stats = {'removed': 0, 'reduced': 0, 'threaded': 0, 'hoisted': 0}
+
+    while True:
+        last = dict(stats)
+        items = simplify(items, stats)
+        items = thread_jumps(items, stats)
+        items = hoist(items, stats)
+        if stats == last:
+            break
+
+    code, sym = generate(items)
+    after = sum(len(item.lines) if isinstance(item, Data) else item.size()
+                for item in items if not isinstance(item, Label))
+    stats['bytes'] = before - after
+
+    return code, sym, stats
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Cooperative asyncio run mode, so one event loop can host many machines.
+
+run() executes a machine in slices of SLICE instructions and yields to
+the event loop after each one, so machines sharing a loop take turns.
+When a machine idles (see interrupts.py) it stops using slices and
+awaits its next deadline or a key instead; that needs a real-time,
+non-blocking InterruptController. session() sets all this up for a
+machine talking over a pair of asyncio streams.
+
+usage: aio.py program.ls8 [port]
+
+Serves program on localhost:port (default 8008), one machine per
+connection.
+"""
+
+import asyncio
+import sys
+
+from cpu import CPU, IDLE, MAX_STEPS
+from devices import StreamInput, StreamOutput
+from interrupts import InterruptController, Keyboard, Timer
+
+# Instructions a machine runs before yielding to the event loop
+SLICE = 10000
+
+
+async def run(cpu, engine=None, slice_steps=SLICE):
+    """
+    Run cpu until it halts or stops with an error. engine is the run
+    method of the engine to use (it's called with max_steps), cpu.run by
+    default. Returns a RunResult for the whole run.
+    """
+    engine = engine or cpu.run
+    interrupts = cpu.interrupts
+    output = bytearray()
+    steps = 0
+
+    while True:
+        result = engine(slice_steps)
+        steps += result.steps
+        output += result.output
+        await cpu.output.drain()
+
+        if result.reason == IDLE:
+            timeout, target, listening = interrupts.waiting
+            woken = False
+            if listening:
+                woken = await cpu.input.wait_async(timeout)
+            else:
+                await asyncio.sleep(timeout)
+            interrupts.wake(woken)
+        elif result.reason == MAX_STEPS:
+            # Let the other machines have a turn
+            await asyncio.sleep(0)
+        else:
+            result.steps = steps
+            result.output = bytes(output)
+            return result
+
+
+async def session(template, reader, writer):
+    """
+    Run a copy of the machine template for one connection, until it
+    halts or the other end hangs up.
+    """
+    keyboard = StreamInput(reader)
+    cpu = template.fork(output=StreamOutput(writer), input=keyboard)
+    InterruptController(cpu, [Timer(), Keyboard()], realtime=True,
+                        blocking=False)
+    machine = asyncio.ensure_future(run(cpu))
+
+    try:
+        await asyncio.wait([machine, keyboard.task],
+                           return_when=asyncio.FIRST_COMPLETED)
+        if machine.done():
+            result = machine.result()
+            if result.error:
+                writer.write(result.error.encode() + b"\n")
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        machine.cancel()
+        keyboard.close()
+        cpu.output.close()
+
+
+async def serve(path, port):
+    template = CPU()
+    template.load(path)
+
+    server = await asyncio.start_server(
+        lambda reader, writer: session(template, reader, writer),
+        'localhost', port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8008
+    asyncio.run(serve(sys.argv[1], port))
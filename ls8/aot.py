@@ -0,0 +1,308 @@
+"""
+Ahead-of-time compilation of LS-8 images into cached Python modules.
+
+The whole image is translated into one Python function: a switch over the
+PC whose cases are the program's basic blocks with their instructions
+inlined. The generated module is written to a cache directory keyed by a
+hash of the image file and of the emulator source, so later runs of the
+same image import it (Python keeps the .pyc next to it) and skip loading
+and decoding altogether.
+
+If the program jumps somewhere that wasn't discovered statically, or
+writes over its own code, the compiled function hands the machine back
+and the CPU interpreter carries on from there.
+"""
+
+import hashlib
+import importlib.util
+import os
+import py_compile
+import sys
+from os.path import dirname, join
+
+from cpu import (CALL, CPU, DIV, HALTED, HLT, INT, IRET, JEQ, JGE, JGT, JLE,
+                 JLT, JNE, IDLE, LDI, MAX_STEPS, MOD, Halt, Pending)
+from translate import TEMPLATES, WRITES, find_block
+
+CACHE_DIR = os.environ.get('LS8_AOT_CACHE', join(dirname(__file__),
+                                                 '__aotcache__'))
+
+# Block entries per leaf of the PC switch
+LEAF_SIZE = 4
+
+# Instructions that set the PC but can carry on at the next one
+FALLS_THROUGH = {CALL, INT, JEQ, JNE, JGT, JLT, JGE, JLE}
+
+
+def source_hash():
+    """Hash of the modules that decide what the generated code does."""
+    h = hashlib.sha256()
+    for module in ('aot.py', 'translate.py', 'cpu.py'):
+        with open(join(dirname(__file__), module), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def image_key(text):
+    """Cache key for the raw contents of an image file."""
+    h = hashlib.sha256(text)
+    h.update(source_hash().encode())
+    return h.hexdigest()[:32]
+
+
+class Compiler:
+    """Translates a loaded image into the source of a Python module."""
+
+    def __init__(self, cpu, length):
+        self.cpu = cpu
+        # Number of bytes the image occupies, starting at 0
+        self.length = length
+
+    def discover(self):
+        """
+        Find every basic block reachable from the entry point. Jump targets are
+        register-indirect, so every LDI immediate that points into the
+        image is treated as a possible entry, along with the fall-through
+        and return address of each block.
+        """
+        blocks = {}
+        todo = [self.cpu.pc]
+
+        while todo:
+            entry = todo.pop()
+            if entry in blocks or entry >= self.length:
+                continue
+
+            insts = find_block(self.cpu.ram, entry)
+            blocks[entry] = insts
+
+            for pc, inst_reg, operand_a, operand_b, next_pc in insts:
+                if inst_reg == LDI:
+                    todo.append(operand_b)
+                elif inst_reg in FALLS_THROUGH:
+                    todo.append(next_pc)
+
+            last_inst, last_next = insts[-1][1], insts[-1][4]
+            if not last_inst & 0b00010000 and last_inst != HLT:
+                todo.append(last_next)
+
+        return blocks
+
+    def block_body(self, insts):
+        """
+        Python statements for one block, ending with the next PC. Every
+        way out of the block counts the instructions it executed.
+        """
+        body = []
+
+        for count, (pc, inst_reg, operand_a, operand_b, next_pc) in \
+                enumerate(insts, 1):
+            sets_pc = inst_reg & 0b00010000
+            fields = {'a': operand_a, 'b': operand_b, 'pc': pc,
+                      'next_pc': next_pc & 0xff}
+            writes = False
+
+            if inst_reg == HLT:
+                body += [f"cpu.pc = {next_pc & 0xff}",
+                         "cpu.halted = True",
+                         f"return steps + {count}"]
+                return body
+            elif inst_reg in (DIV, MOD):
+                # Dividing by zero: let the interpreter report it
+                op = "//=" if inst_reg == DIV else "%="
+                body += [f"if not reg[{operand_b}]:",
+                         f"    cpu.pc = {pc}",
+                         f"    return steps + {count - 1}",
+                         f"reg[{operand_a}] {op} reg[{operand_b}]"]
+            elif inst_reg in (INT, IRET) or \
+                    CPU.branchtable[inst_reg] is CPU.trap:
+                # Hand back, to take interrupts or report the trap
+                body += [f"cpu.pc = {pc}",
+                         f"return steps + {count - 1}"]
+                return body
+            elif inst_reg in TEMPLATES:
+                # The PC lives in a local here
+                body += [t.format(**fields).replace("cpu.pc = ", "pc = ")
+                         for t in TEMPLATES[inst_reg]]
+                writes = inst_reg in WRITES
+            else:
+                body.append(f"cpu.pc = {pc if sets_pc else next_pc & 0xff}")
+                body.append(f"handlers[{inst_reg}](cpu, {operand_a}, "
+                            f"{operand_b})")
+                if sets_pc:
+                    body.append("pc = cpu.pc")
+                writes = True
+
+            if writes:
+                # Self-modifying code: let the interpreter take over
+                resume = "pc" if sets_pc else next_pc & 0xff
+                body += ["if aot.dirty:",
+                         f"    cpu.pc = {resume}",
+                         f"    return steps + {count}"]
+
+        last_inst, last_next = insts[-1][1], insts[-1][4]
+        if not last_inst & 0b00010000:
+            body.append(f"pc = {last_next & 0xff}")
+        body += [f"steps += {len(insts)}",
+                 "if steps >= limit:",
+                 "    cpu.pc = pc",
+                 "    return steps",
+                 "continue"]
+        return body
+
+    def switch(self, entries, blocks, indent):
+        """Emit a binary-search tree of PC tests over sorted entries."""
+        pad = " " * indent
+        lines = []
+
+        if len(entries) <= LEAF_SIZE:
+            for entry in entries:
+                lines.append(f"{pad}if pc == {entry}:")
+                lines += [f"{pad}    {line}"
+                          for line in self.block_body(blocks[entry])]
+            return lines
+
+        mid = len(entries) // 2
+        lines.append(f"{pad}if pc < {entries[mid]}:")
+        lines += self.switch(entries[:mid], blocks, indent + 4)
+        lines.append(f"{pad}else:")
+        lines += self.switch(entries[mid:], blocks, indent + 4)
+        return lines
+
+    def generate(self):
+        """Source for a module with the image and its compiled run()."""
+        blocks = self.discover()
+        entries = sorted(blocks)
+        image = bytes(self.cpu.ram[:self.length])
+
+        lines = [
+            "# Generated by aot.py from an LS-8 image. Do not edit.",
+            "",
+            f"IMAGE = bytes.fromhex('{image.hex()}')",
+            f"ENTRY = {self.cpu.pc}",
+            f"ENTRIES = {tuple(entries)!r}",
+            "",
+            "",
+            "def run(cpu, aot, handlers, limit):",
+            "    reg = cpu.reg",
+            "    ram = cpu.ram",
+            "    pc = cpu.pc",
+            "    steps = 0",
+            "    while True:",
+        ]
+        lines += self.switch(entries, blocks, 8)
+        lines += [
+            "        # Not discovered statically",
+            "        cpu.pc = pc",
+            "        return steps",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class AOT:
+    """Runs a CPU through an ahead-of-time compiled image."""
+
+    def __init__(self, cpu, module):
+        self.cpu = cpu
+        self.module = module
+        # Set when the program writes over its own code
+        self.dirty = False
+        self.entries = set(module.ENTRIES)
+        cpu.invalidate_hooks.append(self.invalidate)
+
+        # The compiled code doesn't decode, so mark the image as code so
+        # writes into it are noticed
+        for i in range(len(module.IMAGE)):
+            cpu.code[i] = 1
+
+    def invalidate(self, address):
+        self.dirty = True
+
+    def run(self, max_steps=None):
+        """
+        Run compiled code, then fall back to the interpreter if needed.
+        With max_steps, stop at the first block boundary after that many
+        instructions. Returns a RunResult, as CPU.run does.
+        """
+        cpu = self.cpu
+        if cpu.halted:
+            return cpu.result(HALTED, 0)
+
+        interrupts = cpu.interrupts
+        entries = self.entries
+        total = sys.maxsize if max_steps is None else max_steps
+        steps = 0
+
+        while steps < total and not self.dirty and cpu.pc in entries:
+            # Compiled code checks the limit between blocks, so this is
+            # where interrupts get looked for
+            limit = total - steps
+            if interrupts is not None:
+                limit = min(limit, interrupts.deadline - cpu.cycles)
+            count = self.module.run(cpu, self, cpu.branchtable, limit)
+            steps += count
+            cpu.cycles += count
+
+            if cpu.halted:
+                return cpu.result(HALTED, steps)
+            if count >= limit:
+                if interrupts is not None and \
+                        cpu.cycles >= interrupts.deadline:
+                    interrupts.service()
+                    if interrupts.waiting:
+                        return cpu.result(IDLE, steps)
+                continue
+            if self.dirty:
+                break
+
+            # Compiled code handed back on something it doesn't do
+            # itself: let the interpreter run that one instruction
+            try:
+                cpu.step()
+            except Pending:
+                interrupts.service()
+            except Halt as halt:
+                return cpu.result(halt.reason, steps + 1, halt.error)
+            steps += 1
+
+        if steps >= total:
+            return cpu.result(MAX_STEPS, steps)
+
+        result = cpu.run(None if max_steps is None else total - steps)
+        result.steps += steps
+        return result
+
+
+def import_module(path, key):
+    spec = importlib.util.spec_from_file_location(f"ls8_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load(cpu, filename):
+    """
+    Load an .ls8 image into cpu through the AOT cache, compiling it first
+    if it isn't cached yet. Returns an AOT ready to run.
+    """
+    with open(filename, 'rb') as f:
+        text = f.read()
+
+    key = image_key(text)
+    path = join(CACHE_DIR, f"ls8_{key}.py")
+
+    if not os.path.exists(path):
+        length = cpu.load(filename)
+        source = Compiler(cpu, length).generate()
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+        py_compile.compile(path)
+
+    module = import_module(path, key)
+    cpu.ram[:len(module.IMAGE)] = module.IMAGE
+    cpu.pc = module.ENTRY
+    return AOT(cpu, module)
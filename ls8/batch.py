@@ -0,0 +1,251 @@
+"""
+Lockstep batch engine: runs many LS-8 machines together with NumPy.
+
+All N machines share one program but each has its own state, kept as
+arrays: an N x 256 RAM, N x 8 registers, and N PCs, flags and halt bits.
+Each step fetches every running lane's instruction at once, groups the
+lanes by opcode and runs each group's handler as a vectorized operation,
+so lanes whose control flow has diverged simply land in different
+groups. Halted lanes drop out of the batch.
+
+Every step costs the same NumPy overhead however few lanes take it, so
+the batch only pays off with many machines. On the benchmark workloads
+it overtakes running the machines one by one on the interpreter at 128
+to 512 lanes, and tops out at 2.5 to 6 times the interpreter's
+throughput from about 2048 lanes on; with fewer lanes, or lanes whose
+control flow diverges, use CPU. python bench/batch.py measures the
+crossover.
+
+Requires NumPy.
+"""
+
+import numpy as np
+
+from cpu import (ALU, CALL, CMP, CPU, DIV, FL_E, FL_G, FL_L, HLT, INT, IRET,
+                 IS, JEQ, JGE, JGT, JLE, JLT, JMP, JNE, LD, LDI, MOD, NOP,
+                 OPERAND_MASKS, POP, PRA, PRN, PUSH, RET, SHL, SHR, SP, ST)
+
+# Operand masks by opcode, as arrays (see cpu.operand_masks)
+MASK_A = np.array([a for a, b in OPERAND_MASKS], dtype=np.uint8)
+MASK_B = np.array([b for a, b in OPERAND_MASKS], dtype=np.uint8)
+
+
+class Batch:
+    """N LS-8 machines stepped in lockstep."""
+
+    def __init__(self, n):
+        """Construct n machines in their power-on state."""
+        self.n = n
+        self.ram = np.zeros((n, 256), dtype=np.uint8)
+        self.reg = np.zeros((n, 8), dtype=np.uint8)
+        self.reg[:, SP] = 0xf4
+        self.pc = np.zeros(n, dtype=np.uint8)
+        self.fl = np.zeros(n, dtype=np.uint8)
+        self.halted = np.zeros(n, dtype=bool)
+        # Printed bytes, one buffer per lane
+        self.output = [bytearray() for _ in range(n)]
+        # Why each lane stopped, if it was an error rather than HLT
+        self.error = [None] * n
+
+        # Handlers by opcode, trapping on anything the LS-8 doesn't have
+        self.branchtable = [self.trap] * 256
+        self.branchtable[NOP] = self.nop
+        self.branchtable[HLT] = self.hlt
+        self.branchtable[LDI] = self.ldi
+        self.branchtable[LD] = self.ld
+        self.branchtable[ST] = self.st
+        self.branchtable[PRN] = self.prn
+        self.branchtable[PRA] = self.pra
+        self.branchtable[PUSH] = self.push
+        self.branchtable[POP] = self.pop
+        self.branchtable[CMP] = self.cmp
+        self.branchtable[JMP] = self.jmp
+        self.branchtable[JEQ] = self.jeq
+        self.branchtable[JNE] = self.jne
+        self.branchtable[JGT] = self.jgt
+        self.branchtable[JLT] = self.jlt
+        self.branchtable[JGE] = self.jge
+        self.branchtable[JLE] = self.jle
+        self.branchtable[CALL] = self.call
+        self.branchtable[RET] = self.ret
+        self.branchtable[INT] = self.interrupt
+        self.branchtable[IRET] = self.iret
+        for op in ALU:
+            self.branchtable[op] = self.alu(op)
+
+    def load(self, program):
+        """
+        Load the same program into every lane. Takes anything CPU.load
+        takes. Returns the address just past the last byte loaded.
+        """
+        cpu = CPU()
+        length = cpu.load(program)
+        self.ram[:, :length] = np.frombuffer(cpu.ram, dtype=np.uint8,
+                                             count=length)
+        self.pc[:] = cpu.pc
+        return length
+
+    def fail(self, lanes, pc, message):
+        """Stop lanes with an error, leaving their PCs on the instruction."""
+        self.halted[lanes] = True
+        self.pc[lanes] = pc
+        for lane, address in zip(lanes.tolist(), pc.tolist()):
+            self.error[lane] = f"{message} at {address:02X}"
+
+    # Handlers take the lanes in the group, their operands and the address
+    # of the instruction being run
+
+    def nop(self, lanes, a, b, pc):
+        pass
+
+    def trap(self, lanes, a, b, pc):
+        self.fail(lanes, pc, "Unknown instruction")
+
+    def hlt(self, lanes, a, b, pc):
+        self.halted[lanes] = True
+
+    def ldi(self, lanes, a, b, pc):
+        self.reg[lanes, a] = b
+
+    def ld(self, lanes, a, b, pc):
+        self.reg[lanes, a] = self.ram[lanes, self.reg[lanes, b]]
+
+    def st(self, lanes, a, b, pc):
+        self.ram[lanes, self.reg[lanes, a]] = self.reg[lanes, b]
+
+    def prn(self, lanes, a, b, pc):
+        for lane, value in zip(lanes.tolist(),
+                               self.reg[lanes, a].tolist()):
+            self.output[lane] += b"%d\n" % value
+
+    def pra(self, lanes, a, b, pc):
+        for lane, value in zip(lanes.tolist(),
+                               self.reg[lanes, a].tolist()):
+            self.output[lane].append(value)
+
+    def alu(self, op):
+        """
+        The handler for ALU instruction op. It works in wide ints and
+        masks to 8 bits, as CPU does.
+        """
+        operation = ALU[op]
+
+        def handler(lanes, a, b, pc):
+            x = self.reg[lanes, a].astype(np.int64)
+            y = self.reg[lanes, b].astype(np.int64)
+            if op in (SHL, SHR):
+                # Shifting by 8 or more clears the byte either way
+                y = np.minimum(y, 8)
+            elif op in (DIV, MOD):
+                zero = y == 0
+                if zero.any():
+                    self.fail(lanes[zero], pc[zero], "Division by zero")
+                    lanes, a, x, y = (lanes[~zero], a[~zero], x[~zero],
+                                      y[~zero])
+            self.reg[lanes, a] = operation(x, y) & 0xff
+
+        return handler
+
+    def cmp(self, lanes, a, b, pc):
+        x = self.reg[lanes, a]
+        y = self.reg[lanes, b]
+        self.fl[lanes] = np.where(x < y, FL_L, np.where(x > y, FL_G, FL_E))
+
+    def jump(self, lanes, a, pc, taken):
+        """Jump the lanes where taken is set; step the rest past."""
+        self.pc[lanes] = np.where(taken, self.reg[lanes, a],
+                                  pc + np.uint8(2))
+
+    def jmp(self, lanes, a, b, pc):
+        self.pc[lanes] = self.reg[lanes, a]
+
+    def jeq(self, lanes, a, b, pc):
+        self.jump(lanes, a, pc, self.fl[lanes] & FL_E)
+
+    def jne(self, lanes, a, b, pc):
+        self.jump(lanes, a, pc, ~self.fl[lanes] & FL_E)
+
+    def jgt(self, lanes, a, b, pc):
+        self.jump(lanes, a, pc, self.fl[lanes] & FL_G)
+
+    def jlt(self, lanes, a, b, pc):
+        self.jump(lanes, a, pc, self.fl[lanes] & FL_L)
+
+    def jge(self, lanes, a, b, pc):
+        self.jump(lanes, a, pc, self.fl[lanes] & (FL_G | FL_E))
+
+    def jle(self, lanes, a, b, pc):
+        self.jump(lanes, a, pc, self.fl[lanes] & (FL_L | FL_E))
+
+    def push(self, lanes, a, b, pc):
+        sp = self.reg[lanes, SP] - np.uint8(1)
+        self.reg[lanes, SP] = sp
+        self.ram[lanes, sp] = self.reg[lanes, a]
+
+    def pop(self, lanes, a, b, pc):
+        sp = self.reg[lanes, SP]
+        self.reg[lanes, a] = self.ram[lanes, sp]
+        # From SP after the load, as CPU.pop does, for POP R7
+        self.reg[lanes, SP] = self.reg[lanes, SP] + np.uint8(1)
+
+    def call(self, lanes, a, b, pc):
+        sp = self.reg[lanes, SP] - np.uint8(1)
+        self.reg[lanes, SP] = sp
+        self.ram[lanes, sp] = pc + np.uint8(2)
+        self.pc[lanes] = self.reg[lanes, a]
+
+    def ret(self, lanes, a, b, pc):
+        sp = self.reg[lanes, SP]
+        self.pc[lanes] = self.ram[lanes, sp]
+        self.reg[lanes, SP] = sp + np.uint8(1)
+
+    def interrupt(self, lanes, a, b, pc):
+        # Lanes have no interrupt controller, so this only sets IS
+        bits = np.left_shift(np.uint8(1), self.reg[lanes, a] & np.uint8(7))
+        self.reg[lanes, IS] |= bits
+        self.pc[lanes] = pc + np.uint8(2)
+
+    def iret(self, lanes, a, b, pc):
+        sp = self.reg[lanes, SP]
+        for register in range(6, -1, -1):
+            self.reg[lanes, register] = self.ram[lanes, sp]
+            sp = sp + np.uint8(1)
+        self.fl[lanes] = self.ram[lanes, sp]
+        self.pc[lanes] = self.ram[lanes, sp + np.uint8(1)]
+        self.reg[lanes, SP] = sp + np.uint8(2)
+
+    def step(self):
+        """Run one instruction on every lane that hasn't halted."""
+        lanes = np.flatnonzero(~self.halted)
+        pc = self.pc[lanes]
+        ram = self.ram
+        inst_reg = ram[lanes, pc]
+        operand_a = ram[lanes, pc + np.uint8(1)] & MASK_A[inst_reg]
+        operand_b = ram[lanes, pc + np.uint8(2)] & MASK_B[inst_reg]
+
+        # Advance the PC of every lane whose instruction doesn't set it
+        inst_size = (inst_reg >> 6) + np.uint8(1)
+        sets_pc = (inst_reg & 0b00010000) != 0
+        self.pc[lanes] = np.where(sets_pc, pc, pc + inst_size)
+
+        for op in np.unique(inst_reg).tolist():
+            group = inst_reg == op
+            self.branchtable[op](lanes[group], operand_a[group],
+                                 operand_b[group], pc[group])
+
+    def run(self, max_steps=None):
+        """
+        Step until every lane halts, or for at most max_steps steps.
+        Returns the number of steps taken.
+        """
+        steps = 0
+        while not self.halted.all():
+            if max_steps is not None and steps >= max_steps:
+                break
+            self.step()
+            steps += 1
+        return steps
+
+    def outputs(self):
+        """Each lane's output as bytes."""
+        return [bytes(output) for output in self.output]
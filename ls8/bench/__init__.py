@@ -0,0 +1,10 @@
+"""
+Emulator benchmarks.
+
+Run the suite from the ls8 directory with:
+
+    python -m bench [--quick] [--engines=a,b] [--out=FILE] [--compare=FILE]
+
+The older single-purpose scripts (decode.py, storage.py, loader.py) live
+here too and still run on their own.
+"""
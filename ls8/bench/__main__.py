@@ -0,0 +1,213 @@
+"""
+Run every workload through every available execution engine.
+
+    python -m bench [--quick] [--engines=a,b] [--workloads=a,b]
+                    [--out=FILE] [--compare=FILE]
+
+Reports MIPS (median and 10th/90th percentile over samples) and peak
+memory allocated during one load and run. --out saves the results as
+JSON; --compare prints each result relative to an earlier saved run.
+"""
+
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+import aot  # noqa: E402
+from bench.workloads import WORKLOADS, build, write_image  # noqa: E402
+from cpu import CPU, HALTED  # noqa: E402
+from devices import NullOutput  # noqa: E402
+import fusion  # noqa: E402
+from translate import Translator  # noqa: E402
+
+try:
+    import numpy  # noqa: F401
+    from batch import Batch
+except ImportError:
+    Batch = None
+
+# Instructions a workload may take before it's judged not to halt
+BUDGET = 10000000
+
+# Lanes in a batch-engine run. This is about where the batch catches up
+# with the interpreter; bench/batch.py measures it at more lane counts.
+LANES = 256
+
+
+def setup_cpu(image, tmp):
+    cpu = CPU(output=NullOutput())
+    cpu.load(image)
+    return cpu, cpu.run
+
+
+def setup_fused(image, tmp):
+    cpu = CPU(output=NullOutput())
+    cpu.load(image)
+    fusion.attach(cpu)
+    return cpu, cpu.run
+
+
+def setup_translate(image, tmp):
+    cpu = CPU(output=NullOutput())
+    cpu.load(image)
+    return cpu, Translator(cpu).run
+
+
+def setup_aot(image, tmp):
+    path = join(tmp, 'image.ls8')
+    write_image(path, image)
+    cpu = CPU(output=NullOutput())
+    engine = aot.load(cpu, path)
+    return cpu, engine.run
+
+
+def interpreted_steps(image):
+    """Steps one run takes, or None if it doesn't halt within BUDGET."""
+    cpu = CPU(output=NullOutput())
+    cpu.load(image)
+    result = cpu.run(max_steps=BUDGET)
+    return result.steps if result.reason == HALTED else None
+
+
+def time_machine(setup, image, tmp, reps):
+    """Seconds for reps runs of a program on one warmed-up machine."""
+    cpu, run = setup(image, tmp)
+    start_state = cpu.snapshot()
+    run(BUDGET)
+
+    start = time.perf_counter()
+    for _ in range(reps):
+        cpu.restore(start_state)
+        run(BUDGET)
+    return time.perf_counter() - start
+
+
+def time_batch(image, reps):
+    """Seconds for reps LANES-wide batch runs."""
+    start = time.perf_counter()
+    for _ in range(reps):
+        batch = Batch(LANES)
+        batch.load(image)
+        batch.run(BUDGET)
+    return time.perf_counter() - start
+
+
+def peak_memory(engine, image, tmp):
+    """Peak bytes allocated while setting up and running once."""
+    tracemalloc.start()
+    if engine == 'batch':
+        batch = Batch(LANES)
+        batch.load(image)
+        batch.run(BUDGET)
+    else:
+        cpu, run = ENGINES[engine](image, tmp)
+        run(BUDGET)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+ENGINES = {
+    'interpreter': setup_cpu,
+    'fused': setup_fused,
+    'translate': setup_translate,
+    'aot': setup_aot,
+}
+if Batch is not None:
+    ENGINES['batch'] = None
+
+
+def measure(engine, image, steps, tmp, samples, target):
+    """Sample MIPS for one workload on one engine."""
+    if engine == 'batch':
+        def sample(reps):
+            return time_batch(image, reps)
+        steps *= LANES
+    else:
+        def sample(reps):
+            return time_machine(ENGINES[engine], image, tmp, reps)
+
+    # Enough repetitions for a sample to take about target seconds
+    reps = 1
+    while sample(reps) < target / 4:
+        reps *= 4
+    reps = max(1, int(reps * target / sample(reps)))
+
+    mips = [steps * reps / sample(reps) / 1e6 for _ in range(samples)]
+    return {
+        'steps': steps,
+        'mips_p50': percentile(mips, 50),
+        'mips_p10': percentile(mips, 10),
+        'mips_p90': percentile(mips, 90),
+        'peak_kb': peak_memory(engine, image, tmp) / 1024,
+    }
+
+
+def main(argv):
+    options = {}
+    for arg in argv[1:]:
+        key, _, value = arg.lstrip('-').partition('=')
+        options[key] = value
+
+    quick = 'quick' in options
+    samples = 3 if quick else 9
+    target = 0.02 if quick else 0.1
+    engines = (options['engines'].split(',') if options.get('engines')
+               else list(ENGINES))
+    workloads = (options['workloads'].split(',') if options.get('workloads')
+                 else list(WORKLOADS))
+
+    baseline = {}
+    if options.get('compare'):
+        with open(options['compare']) as f:
+            for r in json.load(f):
+                baseline[r['workload'], r['engine']] = r
+
+    results = []
+    print(f"{'workload':<14}{'engine':<13}{'steps':>9}{'MIPS p50':>10}"
+          f"{'p10':>8}{'p90':>8}{'peak KB':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the AOT cache out of the tree
+        aot.CACHE_DIR = join(tmp, 'aotcache')
+
+        for name in workloads:
+            image = build(name)
+            steps = interpreted_steps(image)
+            if steps is None:
+                print(f"{name:<14}{'(does not halt; skipped)'}")
+                continue
+
+            for engine in engines:
+                r = measure(engine, image, steps, tmp, samples, target)
+                r.update(workload=name, engine=engine)
+                results.append(r)
+
+                line = (f"{name:<14}{engine:<13}{r['steps']:>9,}"
+                        f"{r['mips_p50']:>10.2f}{r['mips_p10']:>8.2f}"
+                        f"{r['mips_p90']:>8.2f}{r['peak_kb']:>10.1f}")
+                old = baseline.get((name, engine))
+                if old:
+                    line += f"  {r['mips_p50'] / old['mips_p50']:.2f}x"
+                print(line)
+
+    if options.get('out'):
+        with open(options['out'], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {options['out']}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
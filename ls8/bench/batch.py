@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+Find the lane count where the batch engine starts to beat running the
+same number of machines one after another on the interpreter.
+
+Usage (from the ls8 directory):
+
+    python bench/batch.py [max_lanes] [workload ...]
+
+For each workload, prints the aggregate MIPS of a batch at each power of
+two lanes up to max_lanes (default 16384), beside the interpreter's, and
+the first lane count where the batch is faster. Requires NumPy.
+"""
+
+import sys
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from batch import Batch  # noqa: E402
+from bench.workloads import WORKLOADS, build  # noqa: E402
+from cpu import CPU  # noqa: E402
+from devices import NullOutput  # noqa: E402
+
+# Instructions a workload may take before it's judged not to halt
+BUDGET = 10000000
+
+
+def scalar_mips(image, target=0.2):
+    """Interpreter MIPS over enough runs to take target seconds."""
+    steps = 0
+    total = 0
+    while total < target:
+        cpu = CPU(output=NullOutput())
+        cpu.load(image)
+        start = time.perf_counter()
+        steps += cpu.run(max_steps=BUDGET).steps
+        total += time.perf_counter() - start
+    return steps / total / 1e6
+
+
+def batch_mips(image, lanes, steps, target=0.2):
+    """
+    Aggregate batch MIPS, counting steps instructions per lane, over
+    enough runs to take target seconds.
+    """
+    runs = 0
+    total = 0
+    while total < target:
+        batch = Batch(lanes)
+        batch.load(image)
+        start = time.perf_counter()
+        batch.run(BUDGET)
+        total += time.perf_counter() - start
+        runs += 1
+    return runs * lanes * steps / total / 1e6
+
+
+def main(argv):
+    max_lanes = int(argv[1]) if len(argv) > 1 else 16384
+    names = argv[2:] or list(WORKLOADS)
+
+    for name in names:
+        image = build(name)
+        cpu = CPU(output=NullOutput())
+        cpu.load(image)
+        steps = cpu.run(max_steps=BUDGET).steps
+        scalar = scalar_mips(image)
+
+        print(f"{name}: {steps:,} steps, interpreter {scalar:.2f} MIPS")
+        print(f"{'lanes':>8}{'MIPS':>10}{'vs interp':>11}")
+        crossover = None
+        lanes = 1
+        while lanes <= max_lanes:
+            mips = batch_mips(image, lanes, steps)
+            print(f"{lanes:>8,}{mips:>10.2f}{mips / scalar:>10.2f}x")
+            if crossover is None and mips > scalar:
+                crossover = lanes
+            lanes *= 2
+        if crossover is None:
+            print(f"  batch never faster up to {max_lanes:,} lanes")
+        else:
+            print(f"  batch faster from {crossover:,} lanes")
+        print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
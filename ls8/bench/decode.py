@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+Compare instructions/second of the predecoded CPU.run loop against the
+original fetch/decode-every-step loop.
+
+Usage (from the ls8 directory):
+
+    python bench/decode.py [repeats]
+"""
+
+import sys
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from cpu import CPU, Halt  # noqa: E402
+
+EXAMPLES = join(dirname(__file__), '..', 'examples')
+
+
+def legacy_run(cpu):
+    """The run loop as it was before predecoding, kept for comparison."""
+    while True:
+        inst_reg = cpu.ram_read(cpu.pc)
+        operand_a = cpu.ram_read(cpu.pc + 1)
+        operand_b = cpu.ram_read(cpu.pc + 2)
+
+        for k, v in cpu.ir.items():
+            if inst_reg == v:
+                inst = bin(v)
+
+        inst_size = ((inst_reg >> 6) & 0b11) + 1
+        cpu.set_pc = ((inst_reg >> 4) & 0b1) == 1
+        if not cpu.set_pc:
+            cpu.pc += inst_size
+
+        cpu.branchtable[inst_reg](cpu, operand_a, operand_b)
+
+
+def count_steps(code):
+    """Count the instructions one run of a program executes."""
+    cpu = CPU()
+    cpu.load(code)
+    return cpu.run().steps
+
+
+def synthetic(length=240):
+    """A long straight run of ALU work ending in HLT."""
+    code = ['10000010', '00000000', '00000001',   # LDI R0,1
+            '10000010', '00000001', '00000001']   # LDI R1,1
+    while len(code) + 6 < length:
+        code += ['10100000', '00000000', '00000001',  # ADD R0,R1
+                 '10100010', '00000000', '00000001']  # MUL R0,R1
+    code.append('00000001')  # HLT
+    return code
+
+
+def timed(run, code, repeats):
+    """
+    Run a program repeats times on one warmed-up machine, resetting PC and
+    registers between runs, and return the elapsed seconds.
+    """
+    cpu = CPU()
+    cpu.load(code)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cpu.pc = 0
+        cpu.reg[:] = bytes(7) + b'\xf4'
+        cpu.halted = False
+        try:
+            run(cpu)
+        except Halt:
+            pass
+    return time.perf_counter() - start
+
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else 20000
+
+    programs = []
+    for name in ('mult.ls8', 'call.ls8'):
+        with open(join(EXAMPLES, name)) as f:
+            programs.append((name, f.readlines()))
+    programs.append(('synthetic loop', synthetic()))
+
+    print(f"{'program':<16}{'steps':>7}{'legacy IPS':>14}"
+          f"{'predecoded IPS':>16}{'speedup':>9}")
+
+    results = []
+    for name, code in programs:
+        steps = count_steps(code) * repeats
+        legacy = timed(legacy_run, code, repeats)
+        predecoded = timed(CPU.run, code, repeats)
+        results.append((name, steps // repeats, steps / legacy,
+                        steps / predecoded, legacy / predecoded))
+
+    for name, steps, legacy, predecoded, speedup in results:
+        print(f"{name:<16}{steps:>7}{legacy:>14,.0f}{predecoded:>16,.0f}"
+              f"{speedup:>8.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+Profile the examples and workloads for straight-line opcode sequences,
+the data behind fusion.PATTERNS, and time the interpreter with and
+without fusion.
+
+Usage (from the ls8 directory):
+
+    python bench/fusion.py [top]
+
+Sequences are ranked by the share of each program's instructions they
+start, averaged over the programs, so one long-running workload doesn't
+drown out the rest. Each is marked with whether fusion can take it: only
+its last instruction may set the PC or write RAM, and only inlined
+instructions fuse.
+"""
+
+import os
+import sys
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from disasm import NAMES  # noqa: E402
+from bench.workloads import WORKLOADS, build  # noqa: E402
+from counters import Profiler  # noqa: E402
+from cpu import CPU  # noqa: E402
+from devices import NullOutput  # noqa: E402
+import fusion  # noqa: E402
+
+EXAMPLES = join(dirname(__file__), '..', 'examples')
+
+# Examples that wait on the keyboard or the timer never halt
+BUDGET = 200000
+
+
+def programs():
+    for name in sorted(os.listdir(EXAMPLES)):
+        if name.endswith('.ls8'):
+            yield name, join(EXAMPLES, name)
+    for name in WORKLOADS:
+        yield name, build(name)
+
+
+def profile():
+    """
+    (sequence, count, share) for every sequence seen: count is summed
+    over the programs, share is the mean fraction of a program's
+    instructions the sequence starts.
+    """
+    counts = {}
+    shares = {}
+    runs = 0
+    for name, program in programs():
+        cpu = CPU(output=NullOutput())
+        cpu.load(program)
+        cpu.monitor = Profiler()
+        steps = cpu.run(max_steps=BUDGET).steps
+        runs += 1
+        for key, count in cpu.monitor.sequences():
+            counts[key] = counts.get(key, 0) + count
+            shares[key] = shares.get(key, 0) + count / steps
+    return sorted(((key, counts[key], shares[key] / runs) for key in counts),
+                  key=lambda item: -item[2])
+
+
+def seconds(program, fuse, batches=5, target=0.05):
+    """
+    Steps and run time of one run: the best, over batches, of the mean
+    over enough fresh runs to take target seconds. Loading and fusing
+    aren't timed.
+    """
+    best = None
+    for _ in range(batches):
+        reps = 0
+        total = 0
+        while total < target:
+            cpu = CPU(output=NullOutput())
+            cpu.load(program)
+            if fuse:
+                fusion.attach(cpu)
+            start = time.perf_counter()
+            result = cpu.run(max_steps=BUDGET)
+            total += time.perf_counter() - start
+            reps += 1
+        mean = total / reps
+        best = mean if best is None else min(best, mean)
+    return result.steps, best
+
+
+def main(argv):
+    top = int(argv[1]) if len(argv) > 1 else 20
+
+    print(f"{'count':>10}{'share':>8}  {'fusable':<9}sequence")
+    for key, count, share in profile()[:top]:
+        names = " ".join(NAMES.get(op, f"0x{op:02X}") for op in key)
+        mark = "pattern" if key in fusion.PATTERNS else \
+            "yes" if fusion.fusable(key) else "no"
+        print(f"{count:>10,}{share:>8.1%}  {mark:<9}{names}")
+
+    print()
+    print(f"{'workload':<14}{'steps':>9}{'plain us':>10}{'fused us':>10}"
+          f"{'speedup':>9}")
+    for name in WORKLOADS:
+        image = build(name)
+        steps, plain = seconds(image, False)
+        fused_steps, fused = seconds(image, True)
+        assert steps == fused_steps
+        print(f"{name:<14}{steps:>9,}{plain * 1e6:>10.1f}{fused * 1e6:>10.1f}"
+              f"{plain / fused:>8.2f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
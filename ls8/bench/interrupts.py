@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Compare MIPS with and without an interrupt controller attached, to check
+that scheduling interrupts by deadline keeps the engines' speed.
+
+The controller runs the timer and polls a keyboard nobody types on. The
+workloads leave IM clear, so nothing is taken: what's measured is the
+deadline checks and the service() calls.
+
+Usage (from the ls8 directory):
+
+    python bench/interrupts.py [repeats]
+"""
+
+import sys
+import tempfile
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+import aot  # noqa: E402
+from bench.workloads import build, write_image  # noqa: E402
+from cpu import CPU  # noqa: E402
+from devices import NullOutput  # noqa: E402
+from interrupts import InterruptController, Keyboard, Timer  # noqa: E402
+from translate import Translator  # noqa: E402
+
+
+def run_interpreter(cpu, path):
+    cpu.load(path)
+    return cpu.run
+
+
+def run_translate(cpu, path):
+    cpu.load(path)
+    return Translator(cpu).run
+
+
+def run_aot(cpu, path):
+    return aot.load(cpu, path).run
+
+
+ENGINES = {
+    'interpreter': run_interpreter,
+    'translate': run_translate,
+    'aot': run_aot,
+}
+
+
+def best_mips(engine, path, interrupts, repeats):
+    """
+    Best MIPS over repeats runs on one warmed-up machine, restored to its
+    loaded state before each run.
+    """
+    cpu = CPU(output=NullOutput())
+    run = ENGINES[engine](cpu, path)
+    loaded = cpu.snapshot()
+    run()
+
+    best = 0
+    for _ in range(repeats):
+        cpu.restore(loaded)
+        cpu.interrupts = None
+        if interrupts:
+            InterruptController(cpu, [Timer(), Keyboard()])
+
+        start = time.perf_counter()
+        steps = run().steps
+        best = max(best, steps / (time.perf_counter() - start) / 1e6)
+    return best
+
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else 20
+
+    print(f"{'workload':<14}{'engine':<13}{'plain MIPS':>11}"
+          f"{'interrupts MIPS':>17}{'ratio':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        aot.CACHE_DIR = tmp
+
+        for name in ('counted_loop', 'recursion'):
+            path = join(tmp, f"{name}.ls8")
+            write_image(path, build(name))
+
+            for engine in ENGINES:
+                plain = best_mips(engine, path, False, repeats)
+                interrupts = best_mips(engine, path, True, repeats)
+                print(f"{name:<14}{engine:<13}{plain:>11.2f}"
+                      f"{interrupts:>17.2f}{interrupts / plain:>8.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Compare loading text .ls8 programs against binary images.
+
+Generates full-RAM programs (the LS-8 can't hold anything bigger), writes
+each one out in both formats and times CPU.load on all of them.
+
+Usage (from the ls8 directory):
+
+    python bench/loader.py [files]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from cpu import CPU, IMAGE_HEADER, IMAGE_MAGIC, IMAGE_VERSION  # noqa: E402
+
+# Leave room for the stack and interrupt vectors
+IMAGE_SIZE = 0xf4
+
+
+def generate(seed):
+    """A random full-size program image."""
+    rng = random.Random(seed)
+    return bytes(rng.randrange(256) for _ in range(IMAGE_SIZE))
+
+
+def write_text(path, image):
+    with open(path, 'w') as f:
+        f.write("# generated\n\n")
+        for i, byte in enumerate(image):
+            f.write(f"{byte:08b} # byte {i}\n")
+
+
+def write_binary(path, image):
+    with open(path, 'wb') as f:
+        f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, 0,
+                                  len(image), 0))
+        f.write(image)
+
+
+def time_loads(paths):
+    start = time.perf_counter()
+    for path in paths:
+        CPU().load(path)
+    return time.perf_counter() - start
+
+
+def time_machines(count):
+    """Time constructing machines alone, to subtract from load times."""
+    start = time.perf_counter()
+    for _ in range(count):
+        CPU()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    files = int(argv[1]) if len(argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        text_paths = []
+        binary_paths = []
+        for i in range(files):
+            image = generate(i)
+            text_paths.append(join(tmp, f"{i}.ls8"))
+            write_text(text_paths[-1], image)
+            binary_paths.append(join(tmp, f"{i}.ls8b"))
+            write_binary(binary_paths[-1], image)
+
+        size_text = sum(os.path.getsize(p) for p in text_paths) / files
+        size_binary = sum(os.path.getsize(p) for p in binary_paths) / files
+
+        base = time_machines(files)
+        text = time_loads(text_paths) - base
+        binary = time_loads(binary_paths) - base
+
+    print(f"{files:,} images of {IMAGE_SIZE} bytes each "
+          f"(machine construction subtracted)")
+    print(f"{'format':<8}{'file size':>12}{'per load':>12}{'loads/s':>12}")
+    for name, size, t in (('text', size_text, text),
+                          ('binary', size_binary, binary)):
+        print(f"{name:<8}{size:>10,.0f} B{t / files * 1e6:>9.1f} us"
+              f"{files / t:>12,.0f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
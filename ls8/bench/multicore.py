@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+Parallel sum on the multicore machine, to see how it scales with cores.
+
+Every core sums its share of one array (elements core ID, core ID +
+cores, ...), rounds * 255 times over, then takes a TAS lock and adds its
+sum into a shared total. The work is fixed, so more cores should mean
+less wall time, up to the number of host CPUs.
+
+Usage (from the ls8 directory):
+
+    python bench/multicore.py [rounds] [cores,cores,...]
+"""
+
+import os
+import sys
+import time
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+import multicore  # noqa: E402
+from bench.workloads import asm  # noqa: E402
+
+# Array elements; the program has to fit below the cores' stacks
+ELEMENTS = 48
+
+
+def parallel_sum(rounds):
+    """
+    Register use: R1 is the core's sum, R2 the inner repeat count, R3 the
+    array index, R4 holds 0 and R0 is scratch. The rounds count lives on
+    the core's stack.
+    """
+    return "\n".join([
+        "LDI R4,0",
+        "LDI R1,0",
+        f"LDI R2,{rounds}",
+        "PUSH R2",
+        "Round:",
+        "LDI R2,255",
+        "Repeat:",
+        f"LDI R0,{multicore.CORE_ID_ADDRESS}",
+        "LD R3,R0",
+        "Element:",
+        "LDI R0,Data",
+        "ADD R0,R3",
+        "LD R0,R0",
+        "ADD R1,R0",
+        f"LDI R0,{multicore.CORES_ADDRESS}",
+        "LD R0,R0",
+        "ADD R3,R0",
+        f"LDI R0,{ELEMENTS}",
+        "CMP R3,R0",
+        "LDI R0,Element",
+        "JLT R0",
+        "DEC R2",
+        "CMP R2,R4",
+        "LDI R0,Repeat",
+        "JNE R0",
+        "POP R2",
+        "DEC R2",
+        "PUSH R2",
+        "CMP R2,R4",
+        "LDI R0,Round",
+        "JNE R0",
+        "Lock:",
+        "LDI R0,Mutex",
+        "TAS R2,R0",
+        "CMP R2,R4",
+        "LDI R0,Lock",
+        "JNE R0",
+        "LDI R0,Total",
+        "LD R2,R0",
+        "ADD R2,R1",
+        "ST R0,R2",
+        "LDI R0,Mutex",
+        "ST R0,R4",
+        "HLT",
+        "Mutex:",
+        "DB 0",
+        "Total:",
+        "DB 0",
+        "Data:",
+    ] + [f"DB {i * 7 % 256}" for i in range(ELEMENTS)]) + "\n"
+
+
+def main(argv):
+    rounds = int(argv[1]) if len(argv) > 1 else 40
+    if len(argv) > 2:
+        counts = [int(n) for n in argv[2].split(',')]
+    else:
+        most = min(multicore.MAX_CORES, os.cpu_count() or 1)
+        counts = sorted({n for n in (1, 2, 4) if n < most} | {most})
+
+    image, symbols, line_map = asm.assemble(parallel_sum(rounds))
+    total = symbols['TOTAL']
+    expected = sum(i * 7 % 256 for i in range(ELEMENTS)) * rounds * 255
+
+    print(f"host CPUs: {os.cpu_count()}")
+    print(f"{'cores':>5}{'steps':>13}{'wall s':>9}{'MIPS':>8}"
+          f"{'speedup':>9}")
+
+    base = None
+    for cores in counts:
+        start = time.perf_counter()
+        result = multicore.run(image, cores)
+        wall = time.perf_counter() - start
+
+        if result.ram[total] != expected & 0xff:
+            raise Exception(f"Wrong total with {cores} cores: "
+                            f"{result.ram[total]}, not {expected & 0xff}")
+
+        base = base or wall
+        print(f"{cores:>5}{result.steps:>13,}{wall:>9.3f}"
+              f"{result.steps / wall / 1e6:>8.2f}{base / wall:>9.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Throughput of many small jobs: one scheduler.py process time-slicing all
+of them, against one ls8.py process per job.
+
+The jobs cycle through the example programs that stop by themselves,
+stackoverflow.ls8 included. Both sides are timed as whole processes, so
+the per-job side pays interpreter start up every time.
+
+Usage (from the ls8 directory):
+
+    python bench/scheduler.py [jobs] [per-process jobs]
+
+Per-process runs are slow; with fewer per-process jobs than jobs, the
+per-process rate is measured on that many and scaled up.
+"""
+
+import subprocess
+import sys
+import time
+from os.path import dirname, join
+
+HERE = join(dirname(__file__), '..')
+
+PROGRAMS = ['call.ls8', 'mult.ls8', 'print8.ls8', 'printstr.ls8',
+            'sctest.ls8', 'stack.ls8', 'stackoverflow.ls8']
+
+
+def run_quiet(args):
+    """Seconds to run a command with its output thrown away."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=HERE, check=False,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main(argv):
+    jobs = int(argv[1]) if len(argv) > 1 else 1000
+    per_process = int(argv[2]) if len(argv) > 2 else jobs
+    programs = [PROGRAMS[i % len(PROGRAMS)] for i in range(jobs)]
+
+    scheduled = run_quiet(['scheduler.py'] + programs)
+
+    separate = sum(run_quiet(['ls8.py', program])
+                   for program in programs[:per_process])
+    separate *= jobs / per_process
+
+    print(f"{'':<14}{'jobs':>6}{'seconds':>10}{'jobs/s':>10}")
+    print(f"{'scheduler':<14}{jobs:>6}{scheduled:>10.2f}"
+          f"{jobs / scheduled:>10.1f}")
+    print(f"{'per process':<14}{jobs:>6}{separate:>10.2f}"
+          f"{jobs / separate:>10.1f}")
+    print(f"speedup: {separate / scheduled:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
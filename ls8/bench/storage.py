@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Compare bytearray-backed RAM and registers against plain lists of ints,
+for memory use and run speed, on one machine and on many machines kept
+resident at once.
+
+Usage (from the ls8 directory):
+
+    python bench/storage.py [machines]
+"""
+
+import sys
+import time
+import tracemalloc
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from cpu import CPU, SP  # noqa: E402
+
+EXAMPLES = join(dirname(__file__), '..', 'examples')
+
+
+class ListCPU(CPU):
+    """A CPU whose RAM and registers are lists, as they used to be."""
+
+    def __init__(self):
+        super().__init__()
+        self.ram = [0] * 256
+        self.reg = [0] * 8
+        self.reg[SP] = 0xf4
+
+
+def storage_size(cpu):
+    """Bytes used by the RAM and register containers themselves."""
+    return sys.getsizeof(cpu.ram) + sys.getsizeof(cpu.reg)
+
+
+def resident(cls, code, count):
+    """Bytes allocated to keep count loaded machines alive at once."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    machines = []
+    for _ in range(count):
+        cpu = cls()
+        cpu.load(code)
+        machines.append(cpu)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def run_time(cls, code, repeats):
+    """Seconds to load and run a program repeats times."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cpu = cls()
+        cpu.load(code)
+        cpu.run()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    machines = int(argv[1]) if len(argv) > 1 else 10000
+
+    with open(join(EXAMPLES, 'call.ls8')) as f:
+        code = f.readlines()
+
+    print(f"{'':<28}{'list':>14}{'bytearray':>14}")
+
+    sizes = [storage_size(cls()) for cls in (ListCPU, CPU)]
+    print(f"{'RAM + registers, 1 machine':<28}"
+          f"{sizes[0]:>12,} B{sizes[1]:>12,} B")
+
+    totals = [resident(cls, code, machines) for cls in (ListCPU, CPU)]
+    label = f"{machines:,} whole machines"
+    print(f"{label:<28}{totals[0] / 2**20:>11.1f} MB"
+          f"{totals[1] / 2**20:>11.1f} MB")
+
+    storage = [size * machines for size in sizes]
+    label = f"{machines:,} RAM + registers"
+    print(f"{label:<28}{storage[0] / 2**20:>11.1f} MB"
+          f"{storage[1] / 2**20:>11.1f} MB")
+
+    times = [run_time(cls, code, machines) for cls in (ListCPU, CPU)]
+    label = f"{machines:,} load + runs"
+    print(f"{label:<28}{times[0]:>12.2f} s{times[1]:>12.2f} s")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,153 @@
+"""
+Synthetic LS-8 workloads, generated as assembly and built with asm.py.
+
+Each generator returns assembly source, which build() assembles in
+memory. Workloads that do a fixed amount of straight-line work repeat it
+`times` times; with times > 1 the body is wrapped in a counted loop,
+which needs CMP and JNE.
+
+Register conventions: R2 is the outer loop counter, R4 holds 0 and R0 is
+scratch for jump targets. R5-R7 are left alone (IM, IS, SP).
+"""
+
+import sys
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..', '..', 'asm'))
+
+import asm  # noqa: E402
+
+# Bytes of RAM a generated program may use, leaving room for the stack
+CODE_BUDGET = 0xa0
+
+
+def write_image(path, image):
+    """Save assembled code as a binary image file, for the AOT cache."""
+    with open(path, 'wb') as f:
+        asm.write_image(f, image, {})
+
+
+def wrap(body, times, subroutines=()):
+    """
+    Run body times times, then halt. Subroutines go after the HLT, out of
+    the way of the loop.
+    """
+    if times <= 1:
+        lines = body + ["HLT"]
+    else:
+        lines = [
+            "LDI R4,0",
+            f"LDI R2,{times}",
+            "Outer:",
+        ] + body + [
+            "DEC R2",
+            "CMP R2,R4",
+            "LDI R0,Outer",
+            "JNE R0",
+            "HLT",
+        ]
+    return "\n".join(lines + list(subroutines)) + "\n"
+
+
+def counted_loop(inner=250, outer=100):
+    """Nested tight counted loops with one ADD of work per iteration."""
+    return "\n".join([
+        "LDI R4,0",
+        "LDI R1,0",
+        f"LDI R2,{outer}",
+        "Outer:",
+        f"LDI R3,{inner}",
+        "Inner:",
+        "ADD R1,R3",
+        "DEC R3",
+        "CMP R3,R4",
+        "LDI R0,Inner",
+        "JNE R0",
+        "DEC R2",
+        "CMP R2,R4",
+        "LDI R0,Outer",
+        "JNE R0",
+        "HLT",
+    ]) + "\n"
+
+
+def recursion(depth=100, times=1):
+    """A subroutine that calls itself depth levels deep."""
+    return wrap([
+        "LDI R4,0",
+        f"LDI R1,{depth}",
+        "LDI R0,Rec",
+        "CALL R0",
+    ], times, [
+        "Rec:",
+        "CMP R1,R4",
+        "LDI R0,Done",
+        "JEQ R0",
+        "DEC R1",
+        "LDI R0,Rec",
+        "CALL R0",
+        "Done:",
+        "RET",
+    ])
+
+
+def call_chain(depth=24, times=1):
+    """A chain of depth nested subroutine calls."""
+    subroutines = []
+    for i in range(depth):
+        subroutines.append(f"F{i}:")
+        if i + 1 < depth:
+            subroutines += [f"LDI R1,F{i + 1}", "CALL R1"]
+        subroutines.append("RET")
+    return wrap(["LDI R1,F0", "CALL R1"], times, subroutines)
+
+
+def push_pop(pairs=18, times=1):
+    """PUSH/POP churn through the stack."""
+    body = ["LDI R1,7", "LDI R3,9"]
+    for _ in range(pairs):
+        body += ["PUSH R1", "PUSH R3", "POP R1", "POP R3"]
+    return wrap(body, times)
+
+
+def alu_chain(length=25, times=1):
+    """Alternating MUL and ADD."""
+    body = ["LDI R1,3", "LDI R3,5"]
+    for _ in range(length):
+        body += ["MUL R1,R3", "ADD R3,R1"]
+    return wrap(body, times)
+
+
+def output(chars=60, times=1):
+    """PRA of a character in a counted loop, chars times."""
+    return wrap([
+        "LDI R4,0",
+        "LDI R1,65",
+        f"LDI R3,{chars}",
+        "Print:",
+        "PRA R1",
+        "DEC R3",
+        "CMP R3,R4",
+        "LDI R0,Print",
+        "JNE R0",
+    ], times)
+
+
+# name -> (generator, keyword arguments)
+WORKLOADS = {
+    'counted_loop': (counted_loop, {}),
+    'recursion': (recursion, {}),
+    'call_chain': (call_chain, {}),
+    'push_pop': (push_pop, {}),
+    'alu_chain': (alu_chain, {}),
+    'output': (output, {}),
+}
+
+
+def build(name):
+    """Assemble a workload by name, returning its machine code."""
+    generator, kwargs = WORKLOADS[name]
+    image, symbols, line_map = asm.assemble(generator(**kwargs))
+    if len(image) > CODE_BUDGET:
+        raise Exception(f"workload {name} is {len(image)} bytes, over budget")
+    return image
@@ -0,0 +1,202 @@
+"""
+Performance counters for the CPU.
+
+Attach a Profiler to a CPU (cpu.monitor = Profiler()) and CPU.run hands
+the whole run to Profiler.run, which counts as it goes. Without one, the
+normal run loop is used and the counters cost nothing.
+
+Counters:
+
+* instructions executed per opcode and per PC
+* taken and not-taken counts for every PC-setting instruction
+* opcode sequences of 2 to 4 instructions run straight through, without a
+  jump between them (what fusion.py fuses)
+* stack high-water mark
+* instruction bytes fetched
+* wall time
+"""
+
+import sys
+import time
+
+from cpu import FOREVER, IDLE, MAX_STEPS, SP, UNTIL_PC, Halt, Pending
+from disasm import NAMES, disassemble
+
+# Lines to list in the "hottest" section of the report
+HOTTEST = 10
+# Longest straight-line sequence counted
+MAX_RUN = 4
+
+
+class Profiler:
+    """Counts what a CPU does while it runs."""
+
+    def __init__(self):
+        self.opcodes = [0] * 256
+        self.pcs = [0] * 256
+        self.taken = [0] * 256
+        self.not_taken = [0] * 256
+        # Straight-line opcode sequences, by tuple of opcodes
+        self.runs = {}
+        # Lowest SP seen
+        self.stack_low = 0xf4
+        self.steps = 0
+        self.fetched = 0
+        self.seconds = 0.0
+
+    def run(self, cpu, max_steps=None, until_pc=None):
+        """CPU.run, counting every instruction."""
+        decoded = cpu.decoded
+        ram = cpu.ram
+        reg = cpu.reg
+        opcodes = self.opcodes
+        pcs = self.pcs
+        taken = self.taken
+        not_taken = self.not_taken
+        runs = self.runs
+        stack_low = self.stack_low
+        fetched = 0
+        # Opcodes of the straight run leading up to this instruction
+        run = ()
+
+        interrupts = cpu.interrupts
+        limit = FOREVER if max_steps is None else max_steps
+        reason = MAX_STEPS
+        error = None
+        steps = 0
+        start = time.perf_counter()
+
+        while steps < limit:
+            # Run in the same chunks as CPU.run, so interrupts are taken
+            # at the same points
+            chunk = limit - steps
+            if interrupts is not None:
+                chunk = min(chunk, interrupts.deadline - cpu.cycles)
+            count = 0
+            pending = False
+
+            try:
+                for count in range(1, chunk + 1):
+                    pc = cpu.pc
+                    if pc == until_pc:
+                        count -= 1
+                        reason = UNTIL_PC
+                        break
+
+                    inst_reg = ram[pc]
+                    size = ((inst_reg >> 6) & 0b11) + 1
+                    opcodes[inst_reg] += 1
+                    pcs[pc] += 1
+                    fetched += size
+
+                    run += (inst_reg,)
+                    for i in range(len(run) - 1):
+                        key = run[i:]
+                        runs[key] = runs.get(key, 0) + 1
+                    if inst_reg & 0b00010000:
+                        run = ()
+                    elif len(run) == MAX_RUN:
+                        run = run[1:]
+
+                    handler, operand_a, operand_b, cpu.pc = decoded[pc]
+                    try:
+                        handler(cpu, operand_a, operand_b)
+                    except Pending:
+                        # INT or IRET; count it, then look for an
+                        # interrupt to take
+                        pending = True
+
+                    if inst_reg & 0b00010000:
+                        if cpu.pc == (pc + size) & 0xff:
+                            not_taken[pc] += 1
+                        else:
+                            taken[pc] += 1
+
+                    if reg[SP] < stack_low:
+                        stack_low = reg[SP]
+
+                    if pending:
+                        break
+            except Halt as halt:
+                reason = halt.reason
+                error = halt.error
+
+            steps += count
+            cpu.cycles += count
+            if reason != MAX_STEPS:
+                break
+            if interrupts is not None:
+                interrupts.service()
+                if interrupts.waiting:
+                    reason = IDLE
+                    break
+
+        self.seconds += time.perf_counter() - start
+        self.stack_low = stack_low
+        self.fetched += fetched
+        self.steps += steps
+        return cpu.result(reason, steps, error)
+
+    def sequences(self):
+        """
+        Straight-line opcode sequences as ((opcode, ...), count), most
+        frequent first.
+        """
+        return sorted(self.runs.items(), key=lambda item: -item[1])
+
+    def report(self, cpu, file=sys.stderr):
+        """Print an annotated disassembly and the counters."""
+        labels = {address: name for name, address in cpu.symbols.items()}
+        total = self.steps or 1
+
+        def p(*args):
+            print(*args, file=file)
+
+        p("Annotated disassembly (count, % of instructions, branches):")
+        address = 0
+        while address < 256:
+            if not self.pcs[address]:
+                address += 1
+                continue
+
+            if address in labels:
+                p(f"{labels[address]}:")
+            text, size = disassemble(cpu.ram, address)
+            count = self.pcs[address]
+            line = (f"  {address:02X}  {count:>10,}"
+                    f" {count / total:6.1%}  {text}")
+            if self.taken[address] or self.not_taken[address]:
+                line += (f"  ; taken {self.taken[address]:,}"
+                         f" not taken {self.not_taken[address]:,}")
+            p(line)
+            address += size
+
+        p()
+        p("Hottest lines:")
+        hot = sorted(range(256), key=lambda a: -self.pcs[a])[:HOTTEST]
+        for address in hot:
+            if self.pcs[address]:
+                text, _ = disassemble(cpu.ram, address)
+                p(f"  {address:02X}  {self.pcs[address]:>10,}  {text}")
+
+        p()
+        p("Hottest straight-line sequences:")
+        for key, count in self.sequences()[:HOTTEST]:
+            names = " ".join(NAMES.get(op, f"0x{op:02X}") for op in key)
+            p(f"  {count:>10,}  {names}")
+
+        p()
+        p("Instructions by opcode:")
+        for op in sorted(range(256), key=lambda o: -self.opcodes[o]):
+            if self.opcodes[op]:
+                name = NAMES.get(op, f"0x{op:02X}")
+                p(f"  {name:<6}{self.opcodes[op]:>12,}")
+
+        ips = self.steps / self.seconds if self.seconds else 0
+        p()
+        p(f"Instructions:       {self.steps:,}")
+        p(f"Bytes fetched:      {self.fetched:,}")
+        p(f"Stack high-water:   {0xf4 - self.stack_low} bytes "
+          f"(SP low {self.stack_low:02X})")
+        p(f"Time:               {self.seconds:.3f} s")
+        p(f"Instructions/s:     {ips:,.0f}")
@@ -1,140 +1,417 @@
 """CPU functionality."""
 
+import mmap
+import operator
+import os
+import struct
 import sys
-LDI = 0b10000010
-PRN = 0b01000111
+
+from devices import MemoryOutput, NullInput
+
+# Opcodes, from LS8-spec.md
+ADD = 0b10100000
+AND = 0b10101000
+CALL = 0b01010000
+CMP = 0b10100111
+DEC = 0b01100110
+DIV = 0b10100011
 HLT = 0b00000001
+INC = 0b01100101
+INT = 0b01010010
+IRET = 0b00010011
+JEQ = 0b01010101
+JGE = 0b01011010
+JGT = 0b01010111
+JLE = 0b01011001
+JLT = 0b01011000
+JMP = 0b01010100
+JNE = 0b01010110
+LD = 0b10000011
+LDI = 0b10000010
+MOD = 0b10100100
 MUL = 0b10100010
-PUSH = 0b01000101
+NOP = 0b00000000
+NOT = 0b01101001
+OR = 0b10101010
 POP = 0b01000110
-CALL = 0b01010000
+PRA = 0b01001000
+PRN = 0b01000111
+PUSH = 0b01000101
 RET = 0b00010001
-ADD = 0b10100000
+SHL = 0b10101100
+SHR = 0b10101101
+ST = 0b10000100
+SUB = 0b10100001
+XOR = 0b10101011
+
+# R5 is the interrupt mask, R6 the interrupt status, R7 the stack pointer
+IM = 5
+IS = 6
+SP = 7
+
+# FL bits: 00000LGE
+FL_L = 0b100
+FL_G = 0b010
+FL_E = 0b001
+
+
+def operand_masks(inst_reg):
+    """
+    Masks for an instruction's two operand bytes. Register fields are 3
+    bits, LDI's immediate is a whole byte, and bytes past the end of a
+    short instruction belong to the next one, so they read as 0.
+    """
+    inst_size = ((inst_reg >> 6) & 0b11) + 1
+    mask_a = 0b111 if inst_size > 1 else 0
+    mask_b = (0xff if inst_reg == LDI else 0b111) if inst_size > 2 else 0
+    return mask_a, mask_b
+
+
+# Operand masks by opcode
+OPERAND_MASKS = [operand_masks(inst_reg) for inst_reg in range(256)]
+
+# ALU operations by opcode. Handlers mask the results to 8 bits, so these
+# can work on plain ints; the unary ones ignore their second operand.
+ALU = {
+    ADD: operator.add,
+    SUB: operator.sub,
+    MUL: operator.mul,
+    DIV: operator.floordiv,
+    MOD: operator.mod,
+    AND: operator.and_,
+    OR: operator.or_,
+    XOR: operator.xor,
+    SHL: operator.lshift,
+    SHR: operator.rshift,
+    NOT: lambda a, b: ~a,
+    INC: lambda a, b: a + 1,
+    DEC: lambda a, b: a - 1,
+}
+
+# Binary image format, as written by asm.py -b:
+#
+#   magic "LS8B", version, load address, entry point, pad byte,
+#   code length (uint16), symbol table length (uint16), all little-endian,
+#   then the code bytes, then the symbol table as (address, name length,
+#   name) records.
+IMAGE_MAGIC = b'LS8B'
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct('<4sBBBxHH')
+
+
+# Step limit for a run without max_steps. range(1, limit + 1) drops off
+# its fast path past sys.maxsize, so stay one short of it.
+FOREVER = sys.maxsize - 1
+
+# Most instructions one fused entry runs (see fusion.py)
+MAX_FUSED = 4
+
+# Why CPU.run stopped
+HALTED = 'halt'
+MAX_STEPS = 'max_steps'
+UNTIL_PC = 'until_pc'
+# Ran an opcode the LS-8 doesn't have
+TRAPPED = 'trap'
+# Divided by zero
+ERROR = 'error'
+# Idle, with a non-blocking interrupt controller waiting for its next event
+IDLE = 'idle'
+
+
+class Halt(Exception):
+    """
+    Raised by HLT, and by instructions that stop the machine with an
+    error, to stop the run loop.
+    """
+
+    def __init__(self, reason=HALTED, error=None):
+        super().__init__(error)
+        self.reason = reason
+        self.error = error
+
+
+class Pending(Exception):
+    """
+    Raised by INT and IRET when an interrupt controller is attached, so
+    the run loop looks for an interrupt to take before the next fetch.
+    """
+
+
+class RunResult:
+    """What a call to CPU.run did, and the machine state it left."""
+
+    def __init__(self, reason, steps, pc, reg, fl, output, error=None):
+        # HALTED, MAX_STEPS, UNTIL_PC, TRAPPED, ERROR or IDLE
+        self.reason = reason
+        # Instructions executed by this run
+        self.steps = steps
+        self.pc = pc
+        self.reg = reg
+        self.fl = fl
+        # Bytes printed by this run, if the output device captures them
+        self.output = output
+        # What went wrong, for TRAPPED and ERROR
+        self.error = error
+
+    def __repr__(self):
+        return (f"RunResult(reason={self.reason!r}, steps={self.steps}, "
+                f"pc={self.pc}, output={self.output!r})")
+
+
+class Snapshot:
+    """Saved machine state, from CPU.snapshot()."""
+
+    def __init__(self, pc, fl, reg, ram, decoded, code, halted,
+                 interrupts_enabled, cycles):
+        self.pc = pc
+        self.fl = fl
+        self.reg = reg
+        self.ram = ram
+        # The decode cache matching ram, so restoring needn't redecode
+        self.decoded = decoded
+        self.code = code
+        self.halted = halted
+        self.interrupts_enabled = interrupts_enabled
+        self.cycles = cycles
 
 
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
+    ir = {
+        'ADD': ADD,
+        'AND': AND,
+        'CALL': CALL,
+        'CMP': CMP,
+        'DEC': DEC,
+        'DIV': DIV,
+        'HLT': HLT,
+        'INC': INC,
+        'INT': INT,
+        'IRET': IRET,
+        'JEQ': JEQ,
+        'JGE': JGE,
+        'JGT': JGT,
+        'JLE': JLE,
+        'JLT': JLT,
+        'JMP': JMP,
+        'JNE': JNE,
+        'LD': LD,
+        'LDI': LDI,
+        'MOD': MOD,
+        'MUL': MUL,
+        'NOP': NOP,
+        'NOT': NOT,
+        'OR': OR,
+        'POP': POP,
+        'PRA': PRA,
+        'PRN': PRN,
+        'PUSH': PUSH,
+        'RET': RET,
+        'SHL': SHL,
+        'SHR': SHR,
+        'ST': ST,
+        'SUB': SUB,
+        'XOR': XOR,
+    }
+
+    def __init__(self, output=None, input=None):
+        """
+        Construct a new CPU. PRN and PRA write to the output device, which
+        captures into memory by default.
+        """
         self.pc = 0
-        self.ram = [0] * 256
-        self.reg = [0] * 8
+        # RAM and registers only hold bytes; bytearray rejects anything
+        # outside 0-255 rather than letting values drift
+        self.ram = bytearray(256)
+        self.reg = bytearray(8)
+        self.fl = 0
         self.set_pc = False
-        self.reg[7] = 0xf4
-        self.sp = self.reg[7]
-        self.ir = {
-            'LDI': 0b10000010,
-            'PRN': 0b01000111,
-            'HLT': 0b00000001,
-            'MUL': 0b10100010,
-            'CALL': 0b01010000,
-            'RET': 0b00010001,
-            'PUSH': 0b01000101,
-            'POP': 0b01000110,
-            'CALL': 0b01010000,
-            'RET': 0b00010001,
-            'ADD': 0b10100000
-        }
-        self.branchtable = {}
-        self.branchtable[HLT] = self.hlt
-        self.branchtable[LDI] = self.ldi
-        self.branchtable[PRN] = self.prn
-        self.branchtable[MUL] = self.mul
-        self.branchtable[PUSH] = self.push
-        self.branchtable[POP] = self.pop
-        self.branchtable[ADD] = self.add
-        self.branchtable[CALL] = self.call
-        self.branchtable[RET] = self.ret
+        self.reg[SP] = 0xf4
+        self.halted = False
+        # Cleared while an interrupt is being serviced, until IRET
+        self.interrupts_enabled = True
+        # Instructions executed since power on; the clock interrupt
+        # deadlines are counted in
+        self.cycles = 0
+        # The interrupts.InterruptController, when one is attached
+        self.interrupts = None
+        # PRN and PRA instructions executed, so the controller can tell
+        # an idle loop from one that prints
+        self.printed = 0
+        self.output = output or MemoryOutput()
+        self.input = input or NullInput()
+        # A monitor (counters.Profiler, tracer.Tracer) takes over run()
+        # when attached
+        self.monitor = None
+        # Predecoded instruction cache: one (handler, operand_a, operand_b,
+        # next_pc) entry per address. Handlers are plain functions, called
+        # with the CPU, so entries can be shared between machines.
+        # Addresses that haven't been decoded yet hold a "miss" entry that
+        # decodes on first execution.
+        self.decoded = list(self.miss)
+        # 1 for every RAM byte that is part of a decoded instruction
+        self.code = bytearray(256)
+        # Called with the address of every write that hits a code byte
+        self.invalidate_hooks = []
+        # Fused superinstruction entries, shaped like decoded's, when
+        # fusion.attach() has turned fusion on
+        self.fused = None
+        # Instructions run by fused entries beyond the one dispatched
+        self.fused_steps = 0
+        # Label addresses, when the image carries a symbol table
+        self.symbols = {}
+
+    def ram_view(self):
+        """Zero-copy view of RAM, for tracers, snapshotters and loaders."""
+        return memoryview(self.ram)
+
+    def reg_view(self):
+        """Zero-copy view of the register file."""
+        return memoryview(self.reg)
 
     def ram_read(self, MAR):
         return self.ram[MAR]
 
     def ram_write(self, MAR, MDR):
         self.ram[MAR] = MDR
+        if self.code[MAR]:
+            self.invalidate(MAR)
 
-    def load(self, filename):
-        """Load a program into memory."""
+    def invalidate(self, address):
+        """
+        Drop the predecoded entries of every instruction that could cover
+        address (an instruction is at most 3 bytes long).
+        """
+        for start in (address, address - 1, address - 2):
+            start &= 0xff
+            self.decoded[start] = self.miss[start]
+
+        for hook in self.invalidate_hooks:
+            hook(address)
+
+    def invalidate_range(self, start, end):
+        """Invalidate every code byte from start up to end."""
+        code = self.code
+        for address in range(start, end):
+            if code[address]:
+                self.invalidate(address)
+
+    def decode(self, address):
+        """Decode the instruction at address and cache the entry."""
+        inst_reg = self.ram[address]
+        inst_size = ((inst_reg >> 6) & 0b11) + 1
+        handler = self.branchtable[inst_reg]
+        mask_a, mask_b = OPERAND_MASKS[inst_reg]
+        operand_a = self.ram[(address + 1) & 0xff] & mask_a
+        operand_b = self.ram[(address + 2) & 0xff] & mask_b
+
+        # If the instruction sets the PC itself, leave the PC where it is
+        # and let the handler move it
+        if handler is CPU.trap:
+            # Leave the PC on the bad instruction, and tell the trap what
+            # it was
+            operand_a, operand_b, next_pc = address, inst_reg, address
+        elif inst_reg & 0b00010000:
+            next_pc = address
+        else:
+            next_pc = (address + inst_size) & 0xff
+
+        entry = (handler, operand_a, operand_b, next_pc)
+        self.decoded[address] = entry
+        for i in range(inst_size):
+            self.code[(address + i) & 0xff] = 1
+
+        return entry
+
+    def decode_miss(self, address, y):
+        handler, operand_a, operand_b, self.pc = self.decode(address)
+        handler(self, operand_a, operand_b)
+
+    def predecode(self, start=0, end=256):
+        """Decode the program in RAM, walking it linearly from start."""
+        address = start
+        while address < end:
+            self.decode(address)
+            address += ((self.ram[address] >> 6) & 0b11) + 1
+
+    def load(self, program):
+        """
+        Load a program into memory. program is the lines of a text .ls8
+        program, the path to an .ls8 file, text or binary, or machine code
+        as bytes (from asm.assemble(), say). Returns the address just past
+        the last byte loaded.
+        """
+        if isinstance(program, (bytes, bytearray)):
+            if len(program) > 256:
+                raise Exception("Program doesn't fit in RAM")
+            self.ram[:len(program)] = program
+            self.invalidate_range(0, len(program))
+            self.predecode(0, len(program))
+            return len(program)
+
+        if isinstance(program, (str, os.PathLike)):
+            with open(program, 'rb') as f:
+                if f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC:
+                    return self.load_image(f)
+                f.seek(0)
+                program = f.read().decode().splitlines()
 
         address = 0
 
-        # open file
-        # print(sys.argv)
-        # with open(sys.argv[1]) as f:
-        #     for line in f:
-        #         try:
-        #             line2 = line.split('#')[0].strip()
-        #             if line2 == '':
-        #                 continue
-        #         except ValueError:
-        #             pass
-
-        #         line3 = int(line2, 2)
-        #         self.ram[address] = line3
-        #         address += 1
-
-        # For now, we've just hardcoded a program:
-
-        # program = '''
-        # # Print the number 8
-
-        # # This comment and blank line is here to make sure
-        # # they are handled correctly by the file reading        code.
-
-        # 10000010 # LDI R0,8
-        # 00000000
-        # 00001000
-        # 01000111 # PRN R0
-        # 00000000
-        # 00000001 # HLT
-        # '''
-        # print(program)
-        # print(program.split('\n'))
-        # split = program.split('\n')
-        cleaned = []
-        for line in filename:
+        for line in program:
             line1 = line.strip()
             if not line1.startswith('#') and line1.strip():
                 line2 = line1.split('#', 1)[0]
-                cleaned.append(int(line2, 2))
-                # print(line2)
-
-        # for line in program:
-        #     try:
-        #         line2 = line.split('#')[0].strip()
-        #         if line2 == '':
-        #             continue
-        #     except ValueError:
-        #         pass
-        #     line3 = int(line2, 2)
-        #     self.ram[address] = line3
-        #     address += 1
-        # program = [
-        #     # # From print8.ls8
-        #     # 0b10000010,  # LDI R0,8
-        #     # 0b00000000,
-        #     # 0b00001000,
-        #     # 0b01000111,  # PRN R0
-        #     # 0b00000000,
-        #     # 0b00000001,  # HLT
-
-        # ]
-
-        for instruction in cleaned:
-            self.ram[address] = instruction
-            address += 1
+                self.ram[address] = int(line2, 2)
+                address += 1
 
-    def alu(self, op, reg_a, reg_b):
-        """ALU operations."""
+        self.invalidate_range(0, address)
+        self.predecode(0, address)
 
-        if op == "ADD":
-            self.reg[reg_a] += self.reg[reg_b]
-        # elif op == "SUB": etc
-        elif op == 'MUL':
-            self.reg[reg_a] = self.reg[reg_a] * self.reg[reg_b]
-        else:
+        return address
+
+    def load_image(self, f):
+        """
+        Load a binary image from an open file, mapping it and copying the
+        code into RAM in one slice.
+        """
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            (magic, version, load_address, entry, length,
+             symtab_length) = IMAGE_HEADER.unpack_from(image)
+
+            if version != IMAGE_VERSION:
+                raise Exception(f"Unsupported image version {version}")
+
+            end = load_address + length
+            if end > 256:
+                raise Exception("Image doesn't fit in RAM")
+
+            start = IMAGE_HEADER.size
+            self.ram[load_address:end] = image[start:start + length]
+
+            # Symbol table: (address, name length, name) records
+            offset = start + length
+            symtab_end = offset + symtab_length
+            while offset < symtab_end:
+                address, name_length = image[offset], image[offset + 1]
+                name = image[offset + 2:offset + 2 + name_length].decode()
+                self.symbols[name] = address
+                offset += 2 + name_length
+
+        self.pc = entry
+        self.invalidate_range(load_address, end)
+        self.predecode(load_address, end)
+
+        return end
+
+    def alu(self, op, reg_a, reg_b):
+        """Run the ALU operation op, given as its opcode, on two registers."""
+        if op not in ALU and op != CMP:
             raise Exception("Unsupported ALU operation")
 
+        self.branchtable[op](self, reg_a, reg_b)
+
     def trace(self):
         """
         Handy function to print out the CPU state. You might want to call this
@@ -146,8 +423,8 @@ class CPU:
             # self.fl,
             # self.ie,
             self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
+            self.ram_read((self.pc + 1) & 0xff),
+            self.ram_read((self.pc + 2) & 0xff)
         ), end='')
 
         for i in range(8):
@@ -155,138 +432,334 @@ class CPU:
 
         print()
 
-    def ldi(self, register, value):
-        self.reg[register] = value
-        # self.pc += 3
-
-    def prn(self, register, x):
-        print(self.reg[register])
-        # self.pc += 2
+    def nop(self, x, y):
+        pass
 
-    def hlt(self, x, y):
-        sys.exit(0)
-        # self.pc += 1
+    def trap(self, address, inst_reg):
+        # Decoded with the address and opcode as the operands
+        self.halted = True
+        raise Halt(TRAPPED,
+                   f"Unknown instruction {inst_reg:08b} at {address:02X}")
 
-    def mul(self, a, b):
-        self.alu('MUL', a, b)
+    def ldi(self, register, value):
+        self.reg[register] = value
         # self.pc += 3
 
-    def add(self, a, b):
-        self.alu('ADD', a, b)
+    def ld(self, a, b):
+        self.reg[a] = self.ram_read(self.reg[b])
 
-    def call(self, x, y):
-        # print('pc: ', self.pc)
+    def st(self, a, b):
+        self.ram_write(self.reg[a], self.reg[b])
 
-        # push address on stack
-        # self.reg[self.sp] -= 1
-        # push_address = self.reg[self.sp]
-        # self.ram[push_address] = return_address
+    def prn(self, register, x):
+        self.output.write(b"%d\n" % self.reg[register])
+        self.printed += 1
 
-        # get address of NEXT instruction
-        return_address = self.pc + 2
-        # self.sp is already in the register
-        # decrement to find next address for the ram
-        self.sp -= 1
-        self.ram_write(self.sp, return_address)
+    def pra(self, register, x):
+        self.output.write(bytes((self.reg[register],)))
+        self.printed += 1
 
-        # set PC to subroutine address
-        reg_val = self.ram[self.pc + 1]
-        subroutine_address = self.reg[reg_val]
+    def hlt(self, x, y):
+        self.halted = True
+        raise Halt()
+
+    def cmp(self, a, b):
+        x, y = self.reg[a], self.reg[b]
+        if x < y:
+            self.fl = FL_L
+        elif x > y:
+            self.fl = FL_G
+        else:
+            self.fl = FL_E
 
-        self.pc = subroutine_address
+    def jmp(self, register, x):
+        self.pc = self.reg[register]
 
-    def ret(self, x, y):
-        # pop_address = self.reg[self.sp]
-        return_address = self.ram_read(self.sp)
-        self.sp += 1
+    def jeq(self, register, x):
+        if self.fl & FL_E:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xff
 
-        self.pc = return_address
+    def jne(self, register, x):
+        if not self.fl & FL_E:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xff
 
-    # def pop(self, x, y):
-    #     # get value from ram
-    #     mem_address = self.reg[self.sp]
-    #     val = self.ram[mem_address]
+    def jgt(self, register, x):
+        if self.fl & FL_G:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xff
 
-    #     # store in given reg
-    #     reg_val = self.ram[self.pc + 1]
-    #     self.reg[reg_val] = val
-    #     self.pc += 2
+    def jlt(self, register, x):
+        if self.fl & FL_L:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xff
 
-    #     # # another way?
-    #     # self.reg[self.sp] += 1
-    #     # val = self.ram_read(self.sp)
-    #     # # increment sp
-    #     # self.reg[self.sp] += 1
-    #     # return val
+    def jge(self, register, x):
+        if self.fl & (FL_G | FL_E):
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xff
 
-    # def push(self, val, y):
-    #     # decrement because the stack goes downwards
-    #     self.reg[self.sp] -= 1
+    def jle(self, register, x):
+        if self.fl & (FL_L | FL_E):
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xff
 
-    #     # this will keep the pointer in bounds of 00-ff
-    #     self.reg[self.sp] &= 0xff
+    def call(self, operand_a, y):
+        # get address of NEXT instruction
+        return_address = (self.pc + 2) & 0xff
 
-    #     # this will pull out the value at the register address
-    #     reg_val = self.ram_read(self.pc)
-    #     val = self.reg[reg_val]
+        # push it on the stack
+        self.reg[SP] = (self.reg[SP] - 1) & 0xff
+        self.ram_write(self.reg[SP], return_address)
 
-    #     # store that in the memory
-    #     mem_address = self.reg[self.sp]
-    #     self.ram_write(mem_address, val)
-    #     # self.pc += 2
+        # set PC to subroutine address
+        self.pc = self.reg[operand_a]
 
-    #     # # # another way?
-    #     # self.reg[self.sp] -= 1
-    #     # self.ram_write(self.sp, val)
+    def ret(self, x, y):
+        self.pc = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xff
+
+    def interrupt(self, register, x):
+        # Raise the interrupt; it's taken before the next fetch
+        self.reg[IS] |= 1 << (self.reg[register] & 0b111)
+        self.pc = (self.pc + 2) & 0xff
+        if self.interrupts is not None:
+            raise Pending()
+
+    def iret(self, x, y):
+        # R6-R0, then FL, then the return address
+        for register in range(6, -1, -1):
+            self.pop(register, 0)
+        self.fl = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xff
+        self.ret(0, 0)
+        self.interrupts_enabled = True
+        if self.interrupts is not None:
+            raise Pending()
 
     def push(self, operand_a, operand_b):
-        self.sp -= 1
-        # self.reg[self.sp] &= 0xff
-        val = self.reg[operand_a]
-        self.ram_write(self.sp, val)
-        # self.pc += 2
+        # decrement because the stack goes downwards
+        self.reg[SP] = (self.reg[SP] - 1) & 0xff
+        self.ram_write(self.reg[SP], self.reg[operand_a])
 
     def pop(self, operand_a, operand_b):
-        self.reg[operand_a] = self.ram_read(self.sp)
-        # self.pc += 2
-        self.sp += 1
-
-    def run(self):
-        """Run the CPU."""
-        # number of operands = inst value & 0b11000000 >> 6
-        # inst length = number of operands + 1
-        # LDI = 0b10000010
-        # PRN = 0b01000111
-        # HLT = 0b00000001
-
-        running = True
-        # self.trace()
-        while running is True:
-            # self.trace()
-            inst_reg = self.ram_read(self.pc)
-            operand_a = self.ram_read(self.pc+1)
-            operand_b = self.ram_read(self.pc+2)
-
-            # print('inst_reg: ', inst_reg)
-            for k, v in self.ir.items():
-                # print('v', v)
-                if inst_reg == v:
-                    # print('something')
-                    inst = bin(v)
-                    # print('inst: ', inst)
-            # print('inst_out_of_loop', inst)
-            # mask = int(inst, 2) & 0b11000000
-            # mask2 = mask >> 6
-            # op = mask2 + 1
-            # print('op: ', op)
-            inst_size = ((inst_reg >> 6) & 0b11) + 1
-            self.set_pc = ((inst_reg >> 4) & 0b1) == 1
-            # If the instruction didn't set the PC, just move           to the next instruction
-            if not self.set_pc:
-                # could replace inst_size           with op if using the commented out lines
-                self.pc += inst_size
-
-            if inst_reg in self.branchtable:
-                self.branchtable[inst_reg](operand_a, operand_b)
-
-        # print(self.ir['LDI'])
+        self.reg[operand_a] = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xff
+
+    def step(self):
+        """Execute a single instruction."""
+        handler, operand_a, operand_b, self.pc = self.decoded[self.pc]
+        self.cycles += 1
+        handler(self, operand_a, operand_b)
+
+    def snapshot(self):
+        """Capture the machine state so restore() can return to it."""
+        return Snapshot(self.pc, self.fl, bytes(self.reg), bytes(self.ram),
+                        list(self.decoded), bytes(self.code), self.halted,
+                        self.interrupts_enabled, self.cycles)
+
+    def restore(self, snapshot):
+        """Put the machine back into a state captured by snapshot()."""
+        # Anything translated from code bytes that are about to change is
+        # stale
+        changed = []
+        if self.invalidate_hooks:
+            # Set bits mark the bytes that differ
+            diff = (int.from_bytes(self.ram, 'little') ^
+                    int.from_bytes(snapshot.ram, 'little'))
+            while diff:
+                address = ((diff & -diff).bit_length() - 1) >> 3
+                if self.code[address]:
+                    changed.append(address)
+                diff &= ~(0xff << (address * 8))
+
+        old_cycles = self.cycles
+        self.pc = snapshot.pc
+        self.fl = snapshot.fl
+        self.reg[:] = snapshot.reg
+        self.ram[:] = snapshot.ram
+        self.decoded[:] = snapshot.decoded
+        self.code[:] = snapshot.code
+        self.halted = snapshot.halted
+        self.interrupts_enabled = snapshot.interrupts_enabled
+        self.cycles = snapshot.cycles
+        # The controller's deadlines are counted in cycles
+        if self.interrupts is not None:
+            self.interrupts.resync(old_cycles)
+
+        for hook in self.invalidate_hooks:
+            for address in changed:
+                hook(address)
+
+    def fork(self, output=None, input=None):
+        """
+        A new machine in the same state as this one, with its own devices.
+        The decode cache is shared entry by entry; RAM is only 256 bytes,
+        so it's copied outright.
+        """
+        cpu = type(self).__new__(type(self))
+        cpu.pc = self.pc
+        cpu.ram = bytearray(self.ram)
+        cpu.reg = bytearray(self.reg)
+        cpu.fl = self.fl
+        cpu.set_pc = False
+        cpu.halted = self.halted
+        cpu.interrupts_enabled = self.interrupts_enabled
+        cpu.cycles = self.cycles
+        cpu.interrupts = None
+        cpu.printed = 0
+        cpu.output = output or MemoryOutput()
+        cpu.input = input or NullInput()
+        cpu.monitor = None
+        cpu.decoded = list(self.decoded)
+        cpu.code = bytearray(self.code)
+        cpu.invalidate_hooks = []
+        cpu.fused = None
+        cpu.fused_steps = 0
+        cpu.symbols = self.symbols
+        return cpu
+
+    def result(self, reason, steps, error=None):
+        """Package up the state after a run."""
+        self.output.flush()
+        return RunResult(reason, steps, self.pc, bytes(self.reg), self.fl,
+                         self.output.take(), error)
+
+    def run(self, max_steps=None, until_pc=None):
+        """
+        Run the CPU until it halts, until it has executed max_steps
+        instructions, or until the PC reaches until_pc. Returns a
+        RunResult, which includes any output the output device captured.
+        """
+        if self.halted:
+            return self.result(HALTED, 0)
+        if self.monitor is not None:
+            return self.monitor.run(self, max_steps, until_pc)
+
+        decoded = self.decoded
+        fused = self.fused
+        interrupts = self.interrupts
+        limit = FOREVER if max_steps is None else max_steps
+        reason = MAX_STEPS
+        error = None
+        steps = 0
+
+        while steps < limit:
+            # Run straight through to the next interrupt deadline; nothing
+            # in between checks for interrupts
+            chunk = limit - steps
+            if interrupts is not None:
+                chunk = min(chunk, interrupts.deadline - self.cycles)
+            count = 0
+            # Instructions counted from fused rounds, in this chunk
+            done = 0
+
+            try:
+                if until_pc is None and fused is not None:
+                    # A fused entry runs up to MAX_FUSED instructions, so
+                    # only dispatch them while that many fit in the chunk,
+                    # then finish it one instruction at a time
+                    while chunk - done >= MAX_FUSED:
+                        for count in range(
+                                1, (chunk - done) // MAX_FUSED + 1):
+                            handler, operand_a, operand_b, self.pc = \
+                                fused[self.pc]
+                            handler(self, operand_a, operand_b)
+                        done += count + self.fused_steps
+                        count = self.fused_steps = 0
+                    for count in range(1, chunk - done + 1):
+                        handler, operand_a, operand_b, self.pc = \
+                            decoded[self.pc]
+                        handler(self, operand_a, operand_b)
+                elif until_pc is None:
+                    for count in range(1, chunk + 1):
+                        handler, operand_a, operand_b, self.pc = \
+                            decoded[self.pc]
+                        handler(self, operand_a, operand_b)
+                else:
+                    for count in range(1, chunk + 1):
+                        if self.pc == until_pc:
+                            count -= 1
+                            reason = UNTIL_PC
+                            break
+                        handler, operand_a, operand_b, self.pc = \
+                            decoded[self.pc]
+                        handler(self, operand_a, operand_b)
+            except Pending:
+                pass
+            except Halt as halt:
+                reason = halt.reason
+                error = halt.error
+
+            count += done + self.fused_steps
+            self.fused_steps = 0
+            steps += count
+            self.cycles += count
+            if reason != MAX_STEPS:
+                break
+            if interrupts is not None:
+                interrupts.service()
+                if interrupts.waiting:
+                    reason = IDLE
+                    break
+
+        return self.result(reason, steps, error)
+
+    # Handlers by opcode. Every opcode the LS-8 doesn't have traps, so the
+    # run loop never has to check.
+    branchtable = [trap] * 256
+    branchtable[NOP] = nop
+    branchtable[HLT] = hlt
+    branchtable[LDI] = ldi
+    branchtable[LD] = ld
+    branchtable[ST] = st
+    branchtable[PRN] = prn
+    branchtable[PRA] = pra
+    branchtable[PUSH] = push
+    branchtable[POP] = pop
+    branchtable[CMP] = cmp
+    branchtable[JMP] = jmp
+    branchtable[JEQ] = jeq
+    branchtable[JNE] = jne
+    branchtable[JGT] = jgt
+    branchtable[JLT] = jlt
+    branchtable[JGE] = jge
+    branchtable[JLE] = jle
+    branchtable[CALL] = call
+    branchtable[RET] = ret
+    branchtable[INT] = interrupt
+    branchtable[IRET] = iret
+
+
+def alu_handler(op):
+    """
+    The handler for ALU instruction op. Results are masked to 8 bits here,
+    the one place register values can grow.
+    """
+    operation = ALU[op]
+
+    def handler(cpu, reg_a, reg_b):
+        reg = cpu.reg
+        try:
+            reg[reg_a] = operation(reg[reg_a], reg[reg_b]) & 0xff
+        except ZeroDivisionError:
+            # Stop on the DIV or MOD
+            cpu.pc = (cpu.pc - 3) & 0xff
+            cpu.halted = True
+            raise Halt(ERROR, f"Division by zero at {cpu.pc:02X}")
+
+    return handler
+
+
+for op in ALU:
+    CPU.branchtable[op] = alu_handler(op)
+
+# Entries for addresses that haven't been decoded yet
+CPU.miss = [(CPU.decode_miss, address, 0, address) for address in range(256)]
@@ -0,0 +1,333 @@
+"""
+I/O devices for the LS-8.
+
+PRN and PRA write bytes to the CPU's output device. Output devices only
+need write(); flush() and take() are there for the ones that buffer or
+capture.
+
+Input devices supply keystrokes, which the machine sees at KEY_ADDRESS.
+The CPU never reads them itself: the interrupt controller's keyboard
+source polls the device and raises interrupt 1.
+"""
+
+import asyncio
+import collections
+import os
+import selectors
+import sys
+import threading
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+# RAM address that holds the most recent key pressed
+KEY_ADDRESS = 0xf4
+
+
+class OutputDevice:
+    """Base class for output devices."""
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return and forget captured output. Only capturing devices have
+        any to return."""
+        return b''
+
+    async def drain(self):
+        """Wait for written output to go out, for asyncio runs."""
+
+    def close(self):
+        self.flush()
+
+
+class TerminalOutput(OutputDevice):
+    """Line-buffered output to stdout."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout.buffer
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        end = self.buffer.rfind(b'\n')
+        if end != -1:
+            self.stream.write(self.buffer[:end + 1])
+            self.stream.flush()
+            del self.buffer[:end + 1]
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(self.buffer)
+            self.buffer.clear()
+        self.stream.flush()
+
+
+class MemoryOutput(OutputDevice):
+    """Captures everything in memory."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class FileOutput(OutputDevice):
+    """Writes to a file, flushing once flush_size bytes have built up."""
+
+    def __init__(self, path, flush_size=1 << 16):
+        self.file = open(path, 'wb')
+        self.flush_size = flush_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class NullOutput(OutputDevice):
+    """Throws everything away, for benchmarks."""
+
+    def write(self, data):
+        pass
+
+
+class InputDevice:
+    """Base class for input devices."""
+
+    def read(self):
+        """Return the next key as an int, or None if there isn't one."""
+        raise NotImplementedError
+
+    def wait(self, timeout=None):
+        """
+        Block until a key is ready or timeout seconds pass (forever if
+        None). Returns True if a key is ready. Devices that can't tell
+        just sleep.
+        """
+        threading.Event().wait(timeout)
+        return False
+
+    async def wait_async(self, timeout=None):
+        """wait(), for asyncio runs."""
+        if timeout is None:
+            await asyncio.Event().wait()
+        else:
+            await asyncio.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class NullInput(InputDevice):
+    """A keyboard nobody types on."""
+
+    def read(self):
+        return None
+
+
+class BufferInput(InputDevice):
+    """Keys pushed in by the host."""
+
+    def __init__(self, keys=b''):
+        self.keys = bytearray(keys)
+        # Set by push(), to wake wait() and wait_async()
+        self.pushed = threading.Event()
+        self.pushed_async = asyncio.Event()
+
+    def push(self, keys):
+        self.keys += keys
+        self.pushed.set()
+        self.pushed_async.set()
+
+    def read(self):
+        if not self.keys:
+            return None
+        key = self.keys[0]
+        del self.keys[0]
+        return key
+
+    def wait(self, timeout=None):
+        self.pushed.clear()
+        # A push before the clear has already landed in keys
+        if self.keys:
+            return True
+        self.pushed.wait(timeout)
+        return bool(self.keys)
+
+    async def wait_async(self, timeout=None):
+        self.pushed_async.clear()
+        if self.keys:
+            return True
+        try:
+            await asyncio.wait_for(self.pushed_async.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return bool(self.keys)
+
+
+class ScriptedInput(BufferInput):
+    """Keys read from a file up front, so runs are repeatable."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+
+
+class TerminalInput(InputDevice):
+    """
+    Keys from stdin. A background thread waits on stdin with a selector
+    and queues every byte; the CPU side only pops from the queue, so a
+    poll never blocks or makes a system call. A terminal is put in cbreak
+    mode (keys arrive one at a time and aren't echoed; Ctrl-C still
+    works) until close().
+    """
+
+    def __init__(self, stream=None):
+        self.fd = (stream or sys.stdin).fileno()
+        # deque appends and pops are atomic, so neither side locks
+        self.keys = collections.deque()
+        self.ready = threading.Event()
+
+        self.saved = None
+        if termios is not None and os.isatty(self.fd):
+            self.saved = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+
+        # A byte written here tells the thread to stop
+        self.stop_read, self.stop_write = os.pipe()
+        self.thread = threading.Thread(target=self.reader, daemon=True)
+        self.thread.start()
+
+    def reader(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.stop_read, selectors.EVENT_READ)
+            try:
+                selector.register(self.fd, selectors.EVENT_READ)
+            except PermissionError:
+                # A regular file can't be selected on, but never blocks
+                self.queue(os.read(self.fd, 1 << 16))
+                return
+
+            while True:
+                for key, events in selector.select():
+                    if key.fd == self.stop_read:
+                        return
+                    data = os.read(self.fd, 64)
+                    if not data:
+                        return
+                    self.queue(data)
+
+    def queue(self, data):
+        self.keys.extend(data)
+        self.ready.set()
+
+    def read(self):
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            return None
+
+    def wait(self, timeout=None):
+        if self.keys:
+            return True
+        self.ready.clear()
+        # A key may have landed between the check and the clear
+        if self.keys:
+            return True
+        return self.ready.wait(timeout)
+
+    def close(self):
+        os.write(self.stop_write, b'\0')
+        self.thread.join()
+        os.close(self.stop_read)
+        os.close(self.stop_write)
+        if self.saved is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved)
+
+
+class StreamOutput(OutputDevice):
+    """Writes to an asyncio StreamWriter."""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data):
+        # The transport buffers; drain() applies back-pressure
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+class StreamInput(InputDevice):
+    """
+    Keys from an asyncio StreamReader. A task copies them into a queue as
+    they arrive, so polls never wait. Construct it inside a running event
+    loop.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.keys = collections.deque()
+        self.ready = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.pump())
+
+    async def pump(self):
+        while True:
+            data = await self.reader.read(64)
+            if not data:
+                return
+            self.keys.extend(data)
+            self.ready.set()
+
+    def read(self):
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            return None
+
+    def wait(self, timeout=None):
+        # Blocking would stall the event loop; only the asyncio runner
+        # waits on this device
+        return bool(self.keys)
+
+    async def wait_async(self, timeout=None):
+        if self.keys:
+            return True
+        self.ready.clear()
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def close(self):
+        self.task.cancel()
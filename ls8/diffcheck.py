@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Differential check of the translation engine, and of the interpreter
+with superinstruction fusion, against the plain interpreter.
+
+Runs every program in examples/ under each engine and compares the
+registers (including SP), PC, RAM and printed output. Programs that never
+halt are compared after the same number of instructions.
+
+usage: diffcheck.py [max_steps]
+"""
+
+import os
+import sys
+from os.path import dirname, join
+
+import fusion
+from cpu import CPU
+from translate import Translator
+
+EXAMPLES = join(dirname(__file__), 'examples')
+
+
+def state(cpu, result):
+    return {
+        'pc': cpu.pc,
+        'reg': bytes(cpu.reg),
+        'ram': bytes(cpu.ram),
+        'output': result.output,
+        'halted': cpu.halted,
+    }
+
+
+def run_translated(path, max_steps):
+    cpu = CPU()
+    cpu.load(path)
+    result = Translator(cpu).run(max_steps)
+    return state(cpu, result), result.steps
+
+
+def run_interpreted(path, steps, fuse=False):
+    cpu = CPU()
+    cpu.load(path)
+    if fuse:
+        fusion.attach(cpu)
+    result = cpu.run(max_steps=steps)
+    return state(cpu, result), result.steps
+
+
+def main(argv):
+    max_steps = int(argv[1]) if len(argv) > 1 else 10000
+    failures = 0
+
+    for name in sorted(os.listdir(EXAMPLES)):
+        if not name.endswith('.ls8'):
+            continue
+
+        path = join(EXAMPLES, name)
+        translated, steps = run_translated(path, max_steps)
+        interpreted, _ = run_interpreted(path, steps)
+        fused, fused_steps = run_interpreted(path, steps, fuse=True)
+
+        diffs = [k for k in translated if translated[k] != interpreted[k]]
+        diffs += [f"fused {k}" for k in fused if fused[k] != interpreted[k]]
+        if fused_steps != steps:
+            diffs.append("fused steps")
+        if diffs:
+            failures += 1
+            print(f"FAIL {name}: {', '.join(diffs)} differ")
+        else:
+            print(f"ok   {name}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
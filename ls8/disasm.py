@@ -0,0 +1,71 @@
+"""Disassembler for LS-8 machine code."""
+
+# Mnemonics for every opcode in the spec
+NAMES = {
+    0b10100000: 'ADD',
+    0b10101000: 'AND',
+    0b01010000: 'CALL',
+    0b10100111: 'CMP',
+    0b01100110: 'DEC',
+    0b10100011: 'DIV',
+    0b00000001: 'HLT',
+    0b01100101: 'INC',
+    0b01010010: 'INT',
+    0b00010011: 'IRET',
+    0b01010101: 'JEQ',
+    0b01011010: 'JGE',
+    0b01010111: 'JGT',
+    0b01011001: 'JLE',
+    0b01011000: 'JLT',
+    0b01010100: 'JMP',
+    0b01010110: 'JNE',
+    0b10000011: 'LD',
+    0b10000010: 'LDI',
+    0b10100100: 'MOD',
+    0b10100010: 'MUL',
+    0b00000000: 'NOP',
+    0b01101001: 'NOT',
+    0b10101010: 'OR',
+    0b01000110: 'POP',
+    0b01001000: 'PRA',
+    0b01000111: 'PRN',
+    0b01000101: 'PUSH',
+    0b00010001: 'RET',
+    0b10101100: 'SHL',
+    0b10101101: 'SHR',
+    0b10000100: 'ST',
+    0b10100001: 'SUB',
+    # Multicore test-and-set
+    0b10000101: 'TAS',
+    0b10101011: 'XOR',
+}
+
+# Opcodes whose second operand is an immediate rather than a register
+IMMEDIATE = {0b10000010}
+
+
+def inst_size(inst_reg):
+    """Bytes taken by an instruction, from the AA bits of its opcode."""
+    return ((inst_reg >> 6) & 0b11) + 1
+
+
+def disassemble(ram, address):
+    """
+    Disassemble the instruction at address. Returns (text, size).
+    Unknown opcodes come out as DB.
+    """
+    inst_reg = ram[address]
+    size = inst_size(inst_reg)
+    operands = [ram[(address + i) & 0xff] for i in range(1, size)]
+
+    name = NAMES.get(inst_reg)
+    if name is None:
+        return f"DB 0x{inst_reg:02X}", 1
+
+    args = [f"R{op}" for op in operands]
+    if inst_reg in IMMEDIATE and len(operands) == 2:
+        args[1] = str(operands[1])
+
+    if args:
+        return f"{name} {','.join(args)}", size
+    return name, size
@@ -0,0 +1,201 @@
+"""
+Superinstruction fusion for the interpreter.
+
+Common straight-line opcode sequences (a loop tail's DEC, CMP, LDI and
+JNE, say) are run as one fused handler, so CPU.run goes round its
+dispatch loop once for the whole sequence instead of once per
+instruction. Fused handlers are generated from the translator's
+templates, specialised to their operands, and kept in a second decode
+table, cpu.fused, alongside cpu.decoded.
+
+Only the last instruction of a sequence may set the PC or write RAM, and
+nothing in a sequence can raise an interrupt or stop the machine, so a
+fused handler always runs to the end. CPU.run only dispatches through
+the fused table while a whole sequence fits before the next interrupt
+deadline or step limit, and counts every instruction in it, so steps,
+cycles and interrupt timing are exactly as without fusion. Breakpoints
+(until_pc), step() and the monitors use the plain table, one instruction
+at a time.
+
+The patterns come from the profiler's straight-line sequence counts over
+the examples and the benchmark workloads; see bench/fusion.py.
+"""
+
+from cpu import CPU, LD, MAX_FUSED, OPERAND_MASKS, POP
+from disasm import NAMES
+from translate import TEMPLATES, WRITES
+
+# Most bytes a fused sequence can cover
+MAX_SPAN = MAX_FUSED * 3
+
+CODES = {name: code for code, name in NAMES.items()}
+
+
+def pattern(*sequences):
+    return {tuple(CODES[name] for name in s.split()) for s in sequences}
+
+
+# Share of each program's instructions that start the sequence, averaged
+# over the examples and workloads (python bench/fusion.py), with the
+# count summed over them.
+PATTERNS = pattern(
+    # Output loops: 1.3%; the output workload's PRA and loop tail
+    "PRA DEC CMP LDI",
+    # 1.7%, 228 runs; stackoverflow's printing loop
+    "PRN ADD PUSH",
+    # Calls: 4.4%, 130 runs; recursion and call_chain
+    "LDI CALL",
+    "DEC LDI CALL",
+    # 3.3% and 3.1%, mostly setup
+    "LDI LDI",
+    "LDI PRN",
+    # ALU runs: 3.1%; alu_chain
+    "MUL ADD MUL ADD",
+    "ADD MUL ADD MUL",
+    "MUL ADD",
+    "ADD MUL",
+    # Counted loop tails: 3.0%, and 25,216 runs, nearly all of
+    # counted_loop's
+    "ADD DEC CMP LDI",
+    "DEC CMP LDI JNE",
+    "CMP LDI JNE",
+    "CMP LDI JEQ",
+    "LDI JNE",
+    "LDI JEQ",
+    # Stack churn: 2.1%; push_pop. PUSH writes RAM, so only ends one.
+    "POP POP PUSH",
+    "POP PUSH",
+    "POP POP",
+    # Character loops: 0.7%; printstr
+    "LD PRA INC DEC",
+    "INC DEC LDI JMP",
+    "DEC LDI JMP",
+    "LDI JMP",
+)
+
+
+def fusable(sequence):
+    """
+    Whether a sequence of opcodes can be fused: every instruction is one
+    the templates inline, and only the last sets the PC or writes RAM.
+    """
+    if not 2 <= len(sequence) <= MAX_FUSED:
+        return False
+    for op in sequence[:-1]:
+        if op not in TEMPLATES or op & 0b00010000 or op in WRITES:
+            return False
+    return sequence[-1] in TEMPLATES
+
+
+# Generated handlers by source, shared by every site and machine with the
+# same code
+HANDLERS = {}
+
+
+def generate(insts):
+    """
+    Python source for a fused handler running insts, a list of (pc,
+    inst_reg, operand_a, operand_b, next_pc) tuples.
+    """
+    body = [f"cpu.fused_steps += {len(insts) - 1}"]
+    for pc, inst_reg, operand_a, operand_b, next_pc in insts:
+        fields = {'a': operand_a, 'b': operand_b, 'pc': pc,
+                  'next_pc': next_pc}
+        body += [t.format(**fields) for t in TEMPLATES[inst_reg]]
+
+    lines = ["def fused(cpu, a, b):",
+             "    reg = cpu.reg",
+             "    ram = cpu.ram"]
+    lines += ["    " + line for line in body]
+    return "\n".join(lines) + "\n"
+
+
+def compile_handler(insts):
+    source = generate(insts)
+    handler = HANDLERS.get(source)
+    if handler is None:
+        namespace = {}
+        exec(compile(source, "<fused>", "exec"), namespace)
+        handler = HANDLERS[source] = namespace['fused']
+    return handler
+
+
+def fuse_miss(cpu, address, y):
+    handler, operand_a, operand_b, cpu.pc = fuse(cpu, address)
+    handler(cpu, operand_a, operand_b)
+
+
+# Entries for addresses that haven't been looked at yet
+MISS = [(fuse_miss, address, 0, address) for address in range(256)]
+
+
+def fuse(cpu, address):
+    """
+    Build and cache the fused entry for address: the longest pattern
+    starting there, or the plain decoded entry if none matches.
+    """
+    decoded = cpu.decoded
+    ram = cpu.ram
+    # LD and POP read RAM directly in the templates, which would go round
+    # a machine's own ram_read (multicore's core ID register)
+    direct = type(cpu).ram_read is CPU.ram_read
+
+    insts = []
+    pc = address
+    while len(insts) < MAX_FUSED:
+        if decoded[pc][0] is CPU.decode_miss:
+            cpu.decode(pc)
+        inst_reg = ram[pc]
+        if inst_reg not in TEMPLATES or \
+                (not direct and inst_reg in (LD, POP)):
+            break
+        inst_size = ((inst_reg >> 6) & 0b11) + 1
+        next_pc = pc + inst_size
+        mask_a, mask_b = OPERAND_MASKS[inst_reg]
+        insts.append((pc, inst_reg, ram[(pc + 1) & 0xff] & mask_a,
+                      ram[(pc + 2) & 0xff] & mask_b, next_pc))
+        # Only the last instruction may set the PC or write RAM, and
+        # sequences don't run off the top of RAM
+        if inst_reg & 0b00010000 or inst_reg in WRITES or next_pc > 0xff:
+            break
+        pc = next_pc
+
+    for n in range(len(insts), 1, -1):
+        if tuple(inst[1] for inst in insts[:n]) in PATTERNS:
+            last_pc, last_inst, _, _, last_next = insts[n - 1]
+            next_pc = last_pc if last_inst & 0b00010000 else last_next & 0xff
+            entry = (compile_handler(insts[:n]), 0, 0, next_pc)
+            break
+    else:
+        entry = decoded[address]
+        if entry[0] is CPU.decode_miss:
+            entry = cpu.decode(address)
+
+    cpu.fused[address] = entry
+    return entry
+
+
+class Fusion:
+    """Keeps a CPU's fused table in step with its RAM."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        cpu.fused = list(MISS)
+        cpu.invalidate_hooks.append(self.invalidate)
+
+        # Fuse the loaded program now rather than on first execution
+        for address in range(256):
+            if cpu.decoded[address][0] is not CPU.decode_miss:
+                fuse(cpu, address)
+
+    def invalidate(self, address):
+        """Drop every fused entry whose sequence could cover address."""
+        fused = self.cpu.fused
+        for start in range(address - MAX_SPAN + 1, address + 1):
+            start &= 0xff
+            fused[start] = MISS[start]
+
+
+def attach(cpu):
+    """Turn on fusion for a CPU, after its program is loaded."""
+    return Fusion(cpu)
@@ -0,0 +1,258 @@
+"""
+Interrupt controller for the LS-8.
+
+Interrupt sources aren't checked on every instruction. Each one has a
+deadline, counted in instructions executed (cpu.cycles), kept on a heap.
+The engines run straight up to the earliest deadline, then call
+service(), which fires whatever is due and, only if IM & IS leaves an
+interrupt pending, runs the interrupt sequence from the spec.
+
+The controller also spots idle loops. If the machine is in exactly the
+state it was in at the last service() call, and printed nothing since,
+it's in a loop that can only be broken by an interrupt; so the cycle
+count skips straight to the next deadline. In real-time mode the
+controller also sleeps until that deadline is due by the wall clock, or
+until a key arrives; a non-blocking controller leaves the waiting to its
+caller instead (see aio.py).
+"""
+
+import heapq
+import sys
+import time
+
+from cpu import IM, IS, SP
+from devices import KEY_ADDRESS
+
+# Instructions per simulated second
+CLOCK = 1000000
+
+# How often the keyboard is polled, in instructions
+KEY_POLL = 1000
+
+# The controller looks at the machine at least this often, in
+# instructions: to spot idle loops, and interrupts raised while masked
+CHECK = 1000
+
+# Address of the I0 vector; I1-I7 follow
+VECTOR_TABLE = 0xf8
+
+
+class Timer:
+    """Interrupt 0, once per simulated second."""
+
+    # Fired by the clock, not by the input device
+    polls_input = False
+
+    def __init__(self, period=CLOCK):
+        self.period = period
+
+    def fire(self, cpu):
+        cpu.reg[IS] |= 0b1
+
+
+class Keyboard:
+    """
+    Interrupt 1, when the CPU's input device has a key. The key is stored
+    at KEY_ADDRESS for the handler to read.
+    """
+
+    # Real-time idling waits on the input device rather than polling
+    polls_input = True
+
+    def __init__(self, period=KEY_POLL):
+        self.period = period
+
+    def blocked(self, cpu):
+        """
+        True while the last key's interrupt hasn't been taken. Keys stay
+        queued in the device until then, so a slow handler misses none.
+        """
+        return cpu.reg[IS] & 0b10 or not cpu.interrupts_enabled
+
+    def fire(self, cpu):
+        if self.blocked(cpu):
+            return
+        key = cpu.input.read()
+        if key is not None:
+            cpu.ram_write(KEY_ADDRESS, key)
+            cpu.reg[IS] |= 0b10
+
+
+class InterruptController:
+    """Schedules interrupt sources and takes interrupts for a CPU."""
+
+    def __init__(self, cpu, sources=(), realtime=False, blocking=True):
+        """
+        Attach a controller to cpu. With realtime, simulated time is held
+        back to the wall clock (at CLOCK instructions per second) while
+        the machine idles. Without blocking, a real-time idle sets
+        waiting and the engines stop with reason IDLE rather than sleep.
+        """
+        self.cpu = cpu
+        # (deadline, order, source); order breaks ties between sources
+        self.events = []
+        # Cycle count at which service() next has work to do
+        self.deadline = cpu.cycles + CHECK
+        # Machine state and cycle count at the end of the last service(),
+        # to spot idling
+        self.last_state = None
+        self.last_cycles = cpu.cycles
+        self.realtime = realtime
+        self.blocking = blocking
+        # (timeout, target, listening) while a non-blocking idle wait is
+        # outstanding; see idle()
+        self.waiting = None
+        # Wall clock time and cycle count that line up
+        self.epoch = (time.monotonic(), cpu.cycles)
+        cpu.interrupts = self
+
+        for source in sources:
+            self.add(source)
+
+    def add(self, source):
+        """Start a source, its first event one period from now."""
+        deadline = self.cpu.cycles + source.period
+        heapq.heappush(self.events, (deadline, len(self.events), source))
+        self.deadline = min(self.deadline, deadline)
+
+    def resync(self, old_cycles):
+        """
+        Shift the schedule after cpu.cycles jumped from old_cycles (a
+        CPU.restore), so every event is as many cycles away as it was.
+        """
+        cpu = self.cpu
+        shift = cpu.cycles - old_cycles
+        self.events = [(deadline + shift, order, source)
+                       for deadline, order, source in self.events]
+        self.deadline = min(self.events[0][0] if self.events else sys.maxsize,
+                            cpu.cycles + CHECK)
+        self.last_state = None
+        self.last_cycles = cpu.cycles
+        self.epoch = (time.monotonic(), cpu.cycles)
+
+    def service(self):
+        """
+        Fire the events that are due, then take the highest priority
+        pending interrupt if there is one and interrupts are enabled.
+        Called by the engines when cpu.cycles reaches deadline, and
+        after INT and IRET.
+        """
+        cpu = self.cpu
+        events = self.events
+
+        if cpu.cycles > self.last_cycles and self.state() == self.last_state:
+            self.idle()
+        cycles = cpu.cycles
+
+        while events and events[0][0] <= cycles:
+            deadline, order, source = events[0]
+            source.fire(cpu)
+            # An engine that only stops between blocks can overshoot;
+            # skip whole periods rather than firing repeatedly
+            deadline += source.period * ((cycles - deadline) //
+                                         source.period + 1)
+            heapq.heapreplace(events, (deadline, order, source))
+
+        pending = cpu.reg[IM] & cpu.reg[IS]
+        if pending and cpu.interrupts_enabled:
+            self.take(pending)
+
+        self.deadline = min(events[0][0] if events else sys.maxsize,
+                            cycles + CHECK)
+        self.last_state = self.state()
+        self.last_cycles = cpu.cycles
+
+    def state(self):
+        """Everything that decides what the machine does next."""
+        cpu = self.cpu
+        return (cpu.pc, cpu.fl, bytes(cpu.reg), bytes(cpu.ram),
+                cpu.interrupts_enabled, cpu.printed)
+
+    def idle(self):
+        """
+        The machine is spinning until an interrupt: skip the cycle count
+        to the next event that could change that. In real time, sleep
+        until it's due or a key arrives, and skip only as far as the wall
+        clock has got.
+        """
+        cpu = self.cpu
+
+        # Keyboard polls only matter once there's a key they'd deliver;
+        # until then the next event is the next one from any other source
+        listening = any(not source.blocked(cpu)
+                        for deadline, order, source in self.events
+                        if source.polls_input)
+        if listening and cpu.input.wait(0):
+            return
+        target = min((deadline for deadline, order, source in self.events
+                      if not source.polls_input), default=None)
+
+        if not self.realtime:
+            if target is not None:
+                cpu.cycles = max(cpu.cycles, target)
+            return
+
+        start, start_cycles = self.epoch
+        timeout = None
+        if target is not None:
+            timeout = max(0, start + (target - start_cycles) / CLOCK -
+                          time.monotonic())
+
+        if not listening and target is None:
+            # Nothing can wake the machine
+            return
+
+        # Let a partly printed line out before going quiet
+        cpu.output.flush()
+
+        # Wait for up to timeout seconds (forever if None), for a key if
+        # listening, then call wake()
+        self.waiting = (timeout, target, listening)
+        if not self.blocking:
+            return
+
+        woken = False
+        if listening:
+            woken = cpu.input.wait(timeout)
+        else:
+            time.sleep(timeout)
+        self.wake(woken)
+
+    def wake(self, woken):
+        """
+        End an idle wait, moving the cycle count on to match. woken is
+        True if a key cut it short.
+        """
+        cpu = self.cpu
+        timeout, target, listening = self.waiting
+        self.waiting = None
+
+        if woken:
+            # Catch up with the wall clock
+            start, start_cycles = self.epoch
+            now = start_cycles + int((time.monotonic() - start) * CLOCK)
+            if target is not None:
+                now = min(now, target)
+            cpu.cycles = max(cpu.cycles, now)
+        else:
+            cpu.cycles = max(cpu.cycles, target)
+
+        # The machine is still in its idle state; it's up to the events
+        # now due to change that
+        self.last_state = None
+
+    def take(self, pending):
+        """The interrupt sequence, for the lowest numbered pending bit."""
+        cpu = self.cpu
+        reg = cpu.reg
+        number = (pending & -pending).bit_length() - 1
+
+        cpu.interrupts_enabled = False
+        reg[IS] &= ~(1 << number) & 0xff
+
+        # PC, FL, then R0-R6
+        for value in [cpu.pc, cpu.fl] + list(reg[:SP]):
+            reg[SP] = (reg[SP] - 1) & 0xff
+            cpu.ram_write(reg[SP], value)
+
+        cpu.pc = cpu.ram[VECTOR_TABLE + number]
@@ -3,19 +3,61 @@
 """Main."""
 
 import sys
-from os.path import join
+from os.path import dirname, exists, join
 from cpu import *
-# filename = sys.argv[1]
-filename = open(join('./examples/', sys.argv[1]), 'r')
-code = filename.readlines()
-filename.close()
-cpu = CPU()
-cpu.load(code)
-cpu.run()
-
-# try:
-#     cpu.load(filename)
-# except:
-#     sys.exit('Error')
-# cpu.load()
-# cpu.run()
+from counters import Profiler
+from devices import ScriptedInput, TerminalInput, TerminalOutput
+from interrupts import InterruptController, Keyboard, Timer
+from tracer import Tracer
+from translate import Translator
+import aot
+import fusion
+
+# usage: ls8.py [--translate | --aot | --profile | --trace=FILE]
+#               [--keys=FILE] program.ls8
+args = sys.argv[1:]
+translate = '--translate' in args
+compiled = '--aot' in args
+profile = '--profile' in args
+trace = [a.split('=', 1)[1] for a in args if a.startswith('--trace=')]
+# Type the keys in FILE instead of reading the keyboard
+keys = [a.split('=', 1)[1] for a in args if a.startswith('--keys=')]
+args = [a for a in args if not a.startswith('--')]
+
+# Programs are looked up as given, then in examples/
+path = args[0]
+if not exists(path):
+    path = join(dirname(__file__), 'examples', path)
+
+keyboard = ScriptedInput(keys[0]) if keys else TerminalInput()
+cpu = CPU(output=TerminalOutput(), input=keyboard)
+InterruptController(cpu, [Timer(), Keyboard()], realtime=True)
+
+try:
+    if compiled:
+        # The AOT cache loads the image itself
+        result = aot.load(cpu, path).run()
+    else:
+        cpu.load(path)
+
+        if profile:
+            # Counting needs the interpreter
+            cpu.monitor = Profiler()
+            result = cpu.run()
+            cpu.monitor.report(cpu)
+        elif trace:
+            # Stream every record to the trace file
+            cpu.monitor = Tracer(file=trace[0])
+            result = cpu.run()
+            cpu.monitor.close()
+        elif translate:
+            result = Translator(cpu).run()
+        else:
+            fusion.attach(cpu)
+            result = cpu.run()
+finally:
+    cpu.input.close()
+
+if result.error:
+    print(result.error, file=sys.stderr)
+    sys.exit(1)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+Multicore LS-8: several cores sharing one RAM, each in its own process so
+they really run in parallel.
+
+RAM lives in a multiprocessing.shared_memory block. Every core loads the
+same program and starts at the same entry point; a program tells the
+cores apart by reading its core ID, which each core sees at
+CORE_ID_ADDRESS, and finds how many there are at CORES_ADDRESS. Each core
+gets its own STACK_SIZE bytes of stack, below those of the cores
+numbered before it.
+
+For locks, cores have one extra instruction:
+
+    TAS registerA registerB     10000101 00000aaa 00000bbb
+
+Atomically test-and-set the byte at the address in registerB: if it is 0,
+set it to 1. Either way, registerA gets the byte's old value, so 0 means
+the lock was taken. Release a lock with an ordinary ST of 0.
+
+Each core's decode cache is its own, so code one core writes isn't seen
+by the others if they have already run it. Keep code read-only, and
+share data.
+
+Usage:
+
+    python multicore.py program.ls8 [cores]
+"""
+
+import multiprocessing
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+from os.path import dirname, exists, join
+
+from cpu import CPU, SP
+
+# Test-and-set, the multicore extension
+TAS = 0b10000101
+
+# Reserved bytes of the memory map: the reading core's ID, and the number
+# of cores
+CORE_ID_ADDRESS = 0xf5
+CORES_ADDRESS = 0xf6
+
+MAX_CORES = 8
+STACK_SIZE = 8
+
+# Seconds to wait for a result before checking that the cores are alive
+POLL = 0.1
+
+
+class Core(CPU):
+    """One core: a CPU whose RAM is shared with the other cores."""
+
+    def __init__(self, core_id, ram, lock, output=None):
+        super().__init__(output=output)
+        self.ram = ram
+        self.core_id = core_id
+        # Held around every TAS, on every core
+        self.lock = lock
+        self.reg[SP] = 0xf4 - core_id * STACK_SIZE
+
+    def ram_read(self, MAR):
+        if MAR == CORE_ID_ADDRESS:
+            return self.core_id
+        return self.ram[MAR]
+
+    def tas(self, a, b):
+        address = self.reg[b]
+        with self.lock:
+            old = self.ram[address]
+            # Only ever write to a free lock, so a release by ST that
+            # lands in the middle of this can't be lost
+            if not old:
+                self.ram_write(address, 1)
+        self.reg[a] = old
+
+    branchtable = list(CPU.branchtable)
+    branchtable[TAS] = tas
+
+
+class MulticoreResult:
+    """What a multicore run did."""
+
+    def __init__(self, results, seconds, ram):
+        # Each core's RunResult, in core order
+        self.results = results
+        # Each core's run time, not counting process start up
+        self.seconds = seconds
+        # RAM as the cores left it
+        self.ram = ram
+        self.steps = sum(result.steps for result in results)
+
+    def __repr__(self):
+        return (f"MulticoreResult(cores={len(self.results)}, "
+                f"steps={self.steps})")
+
+
+def run_core(name, core_id, pc, end, lock, max_steps, results):
+    """Process body: run one core on the shared RAM called name."""
+    memory = shared_memory.SharedMemory(name=name)
+    cpu = Core(core_id, memory.buf, lock)
+    cpu.pc = pc
+    cpu.predecode(0, end)
+
+    start = time.perf_counter()
+    result = cpu.run(max_steps)
+    results.put((core_id, result, time.perf_counter() - start))
+
+    # The buffer can't be closed while the core still holds it
+    cpu.ram = None
+    memory.close()
+
+
+def run(program, cores=2, max_steps=None):
+    """
+    Load program (as for CPU.load) into shared RAM and run it on cores
+    cores, until every core halts or has executed max_steps instructions.
+    Returns a MulticoreResult.
+    """
+    if not 1 <= cores <= MAX_CORES:
+        raise Exception(f"Cores must be 1 to {MAX_CORES}")
+
+    loader = CPU()
+    end = loader.load(program)
+
+    memory = shared_memory.SharedMemory(create=True, size=256)
+    try:
+        memory.buf[:256] = loader.ram
+        memory.buf[CORES_ADDRESS] = cores
+
+        lock = multiprocessing.Lock()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=run_core,
+                args=(memory.name, core_id, loader.pc, end, lock, max_steps,
+                      results))
+            for core_id in range(cores)
+        ]
+        for process in processes:
+            process.start()
+
+        # Drain the queue before joining, or a core could block putting
+        # its result
+        by_core = {}
+        seconds = {}
+        while len(by_core) < cores:
+            try:
+                core_id, result, elapsed = results.get(timeout=POLL)
+            except queue.Empty:
+                # A core that exits cleanly has put its result already, so
+                # only a failed one never will
+                for core_id, process in enumerate(processes):
+                    if process.exitcode not in (None, 0):
+                        for other in processes:
+                            other.terminate()
+                            other.join()
+                        raise Exception(f"Core {core_id} died with exit "
+                                        f"code {process.exitcode}")
+                continue
+            by_core[core_id] = result
+            seconds[core_id] = elapsed
+        for process in processes:
+            process.join()
+
+        return MulticoreResult([by_core[i] for i in range(cores)],
+                               [seconds[i] for i in range(cores)],
+                               bytes(memory.buf[:256]))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def main(argv):
+    if len(argv) < 2:
+        print("usage: multicore.py program.ls8 [cores]", file=sys.stderr)
+        return 1
+
+    # Programs are looked up as given, then in examples/
+    path = argv[1]
+    if not exists(path):
+        path = join(dirname(__file__), 'examples', path)
+    cores = int(argv[2]) if len(argv) > 2 else 2
+
+    start = time.perf_counter()
+    multicore = run(path, cores)
+    wall = time.perf_counter() - start
+
+    for result in multicore.results:
+        sys.stdout.buffer.write(result.output)
+    sys.stdout.flush()
+
+    status = 0
+    for core_id, result in enumerate(multicore.results):
+        seconds = multicore.seconds[core_id]
+        print(f"core {core_id}: {result.reason:<9} {result.steps:>12,} steps"
+              f" {seconds:8.3f} s", file=sys.stderr)
+        if result.error:
+            print(f"core {core_id}: {result.error}", file=sys.stderr)
+            status = 1
+    print(f"total:   {multicore.steps:>22,} steps {wall:8.3f} s wall",
+          file=sys.stderr)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Golden-output test runner.
+
+Runs every .ls8 program in examples/ (and, with --asm, every ../asm/*.asm
+source, assembled in memory) across a process pool. Each program gets a
+step budget and a wall-clock timeout, and its output is compared against
+golden/<name>.out (shared by name.ls8 and name.asm). Programs without a
+golden file are run and reported but don't pass or fail.
+
+Programs run with the timer and keyboard interrupts, counted in simulated
+time so runs are repeatable. Keys come from golden/<name>.in if there is
+one.
+
+usage: runtests.py [--asm] [--update] [--steps=N] [--timeout=SECONDS]
+                   [--jobs=N] [program ...]
+
+--update writes golden files for every program that halts.
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os.path import basename, dirname, exists, join, splitext
+
+from cpu import CPU, HALTED, MAX_STEPS
+from devices import ScriptedInput
+from interrupts import InterruptController, Keyboard, Timer
+
+HERE = dirname(os.path.abspath(__file__))
+EXAMPLES = join(HERE, 'examples')
+ASM_DIR = join(HERE, '..', 'asm')
+GOLDEN = join(HERE, 'golden')
+
+# Instructions between timeout checks
+SLICE = 10000
+
+
+def assemble(path):
+    """Assemble an .asm file in memory, returning its machine code."""
+    sys.path.insert(0, ASM_DIR)
+    import asm
+
+    with open(path) as f:
+        image, symbols, line_map = asm.assemble(f.read())
+    return image
+
+
+def run_program(job):
+    """
+    Run one program. Returns (name, reason, steps, seconds, output), where
+    reason is HALTED, TRAPPED, ERROR, 'budget' or 'timeout'.
+    """
+    path, max_steps, timeout = job
+    name = basename(path)
+
+    keys = join(GOLDEN, f"{splitext(name)[0]}.in")
+    cpu = CPU(input=ScriptedInput(keys) if exists(keys) else None)
+    InterruptController(cpu, [Timer(), Keyboard()])
+    if path.endswith('.asm'):
+        cpu.load(assemble(path))
+    else:
+        cpu.load(path)
+
+    output = bytearray()
+    steps = 0
+    reason = 'budget'
+    start = time.perf_counter()
+
+    while steps < max_steps:
+        result = cpu.run(max_steps=min(SLICE, max_steps - steps))
+        steps += result.steps
+        output += result.output
+        if result.reason != MAX_STEPS:
+            reason = result.reason
+            break
+        if time.perf_counter() - start > timeout:
+            reason = 'timeout'
+            break
+
+    return name, reason, steps, time.perf_counter() - start, bytes(output)
+
+
+def discover(with_asm):
+    paths = [join(EXAMPLES, f) for f in sorted(os.listdir(EXAMPLES))
+             if f.endswith('.ls8')]
+    if with_asm:
+        paths += [join(ASM_DIR, f) for f in sorted(os.listdir(ASM_DIR))
+                  if f.endswith('.asm')]
+    return paths
+
+
+def main(argv):
+    options = {}
+    programs = []
+    for arg in argv[1:]:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            options[key] = value
+        else:
+            programs.append(os.path.abspath(arg))
+
+    max_steps = int(options.get('steps') or 1000000)
+    timeout = float(options.get('timeout') or 5)
+    jobs = int(options.get('jobs') or os.cpu_count())
+    update = 'update' in options
+
+    paths = programs or discover('asm' in options)
+    work = [(path, max_steps, timeout) for path in paths]
+
+    failures = 0
+    total_steps = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunksize = max(1, len(work) // (jobs * 4))
+        for name, reason, steps, seconds, output in \
+                pool.map(run_program, work, chunksize=chunksize):
+            total_steps += steps
+            golden = join(GOLDEN, f"{splitext(name)[0]}.out")
+
+            if update and reason == HALTED:
+                os.makedirs(GOLDEN, exist_ok=True)
+                with open(golden, 'wb') as f:
+                    f.write(output)
+
+            if not exists(golden):
+                status = 'SKIP'
+            else:
+                with open(golden, 'rb') as f:
+                    expected = f.read()
+                # Printing the right thing doesn't count unless the
+                # program then halted
+                status = ('PASS' if reason == HALTED and output == expected
+                          else 'FAIL')
+                if status == 'FAIL':
+                    failures += 1
+
+            ips = steps / seconds if seconds else 0
+            print(f"{status} {name:<20}{reason:>8}{steps:>10,} steps"
+                  f"{seconds * 1000:>9.1f} ms{ips:>12,.0f} IPS")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(work)} programs, {failures} failed, {total_steps:,} "
+          f"instructions in {elapsed:.2f} s")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Run many LS-8 programs in one process, time-sliced.
+
+Each job is its own machine, forked from a template loaded once per
+program, so jobs share nothing but the decode cache entries they start
+with. The scheduler runs the jobs round robin, each for quantum *
+priority instructions at a time, so a job that never halts only slows
+the others down. A job stops for good when it halts, traps, or has used
+up its own step budget.
+
+Jobs get the timer and keyboard interrupts, counted in simulated time as
+in runtests.py, and no keys.
+
+Usage:
+
+    python scheduler.py [--quantum=N] [--steps=N] program.ls8 ...
+"""
+
+import collections
+import sys
+import time
+from os.path import dirname, exists, join
+
+from cpu import CPU, MAX_STEPS
+from interrupts import InterruptController, Keyboard, Timer
+
+# Instructions a priority 1 job runs before the next job gets a turn
+QUANTUM = 10000
+
+
+class Job:
+    """One program's machine, and what it has done so far."""
+
+    def __init__(self, name, cpu, priority=1, max_steps=None):
+        self.name = name
+        self.cpu = cpu
+        self.priority = priority
+        # Step budget; None runs until the program stops itself
+        self.max_steps = max_steps
+        self.steps = 0
+        self.output = bytearray()
+        # Seconds spent running this job, and from the start of
+        # Scheduler.run() until it finished
+        self.seconds = 0
+        self.turnaround = None
+        # The last run's RunResult; its reason is why the job stopped
+        self.result = None
+
+    def __repr__(self):
+        reason = self.result.reason if self.result else None
+        return (f"Job({self.name!r}, priority={self.priority}, "
+                f"steps={self.steps}, reason={reason!r})")
+
+
+class Scheduler:
+    """Time-slices jobs in one process."""
+
+    def __init__(self, quantum=QUANTUM):
+        # A zero slice would go round the ready queue forever
+        if quantum < 1:
+            raise ValueError(f"quantum must be at least 1, not {quantum}")
+        self.quantum = quantum
+        self.jobs = []
+        # Loaded machines by program path, to fork jobs from
+        self.templates = {}
+
+    def add(self, program, priority=1, max_steps=None, name=None):
+        """
+        Add a job running program, the path to an .ls8 file. Higher
+        priorities get proportionally longer slices. Returns the Job.
+        """
+        if priority < 1:
+            raise ValueError(f"priority must be at least 1, not {priority}")
+        if max_steps is not None and max_steps < 0:
+            raise ValueError(f"max_steps can't be negative: {max_steps}")
+
+        template = self.templates.get(program)
+        if template is None:
+            template = self.templates[program] = CPU()
+            template.load(program)
+
+        cpu = template.fork()
+        InterruptController(cpu, [Timer(), Keyboard()])
+        job = Job(name or str(program), cpu, priority, max_steps)
+        self.jobs.append(job)
+        return job
+
+    def run(self):
+        """Run every job until it stops. Returns the jobs."""
+        ready = collections.deque(self.jobs)
+        start = time.perf_counter()
+
+        while ready:
+            job = ready.popleft()
+            slice_steps = self.quantum * job.priority
+            if job.max_steps is not None:
+                slice_steps = min(slice_steps, job.max_steps - job.steps)
+
+            slice_start = time.perf_counter()
+            result = job.cpu.run(max_steps=slice_steps)
+            now = time.perf_counter()
+
+            job.seconds += now - slice_start
+            job.steps += result.steps
+            job.output += result.output
+            job.result = result
+
+            if result.reason == MAX_STEPS and job.steps != job.max_steps:
+                ready.append(job)
+            else:
+                job.turnaround = now - start
+
+        return self.jobs
+
+
+def main(argv):
+    options = {}
+    programs = []
+    for arg in argv[1:]:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            options[key] = value
+        else:
+            programs.append(arg)
+
+    if not programs:
+        print("usage: scheduler.py [--quantum=N] [--steps=N] program.ls8 ...",
+              file=sys.stderr)
+        return 1
+
+    scheduler = Scheduler(int(options.get('quantum', QUANTUM)))
+    max_steps = int(options['steps']) if 'steps' in options else None
+
+    for program in programs:
+        # Programs are looked up as given, then in examples/
+        path = program
+        if not exists(path):
+            path = join(dirname(__file__), 'examples', path)
+        scheduler.add(path, max_steps=max_steps, name=program)
+
+    start = time.perf_counter()
+    jobs = scheduler.run()
+    wall = time.perf_counter() - start
+
+    for job in jobs:
+        sys.stdout.buffer.write(job.output)
+    sys.stdout.flush()
+
+    for job in jobs:
+        print(f"{job.name:<24} {job.result.reason:<9} {job.steps:>12,} steps"
+              f" {job.seconds * 1000:9.1f} ms run"
+              f" {job.turnaround * 1000:9.1f} ms turnaround", file=sys.stderr)
+    print(f"{len(jobs)} jobs, {sum(job.steps for job in jobs):,} steps "
+          f"in {wall:.3f} s", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+Decode a binary trace into TRACE text.
+
+usage: tracedump.py [--pc=XX] [--op=NAME] [--first=N] [--last=N] trace.bin
+
+--pc and --op (hex address, opcode mnemonic) keep only matching records.
+--first and --last keep the first or last N records after filtering.
+"""
+
+import sys
+from collections import deque
+
+from disasm import NAMES
+from tracer import format_record, read_trace
+
+
+def main(argv):
+    options = {}
+    args = []
+    for arg in argv[1:]:
+        if arg.startswith('--') and '=' in arg:
+            key, value = arg[2:].split('=', 1)
+            options[key] = value
+        else:
+            args.append(arg)
+
+    if len(args) != 1:
+        print(__doc__.strip().splitlines()[2], file=sys.stderr)
+        return 1
+
+    pc = int(options['pc'], 16) if 'pc' in options else None
+    opcode = None
+    if 'op' in options:
+        codes = {name: code for code, name in NAMES.items()}
+        opcode = codes[options['op'].upper()]
+
+    records = read_trace(args[0])
+    if pc is not None:
+        records = (r for r in records if r[0] == pc)
+    if opcode is not None:
+        records = (r for r in records if r[1] == opcode)
+
+    if 'last' in options:
+        records = deque(records, maxlen=int(options['last']))
+    if 'first' in options:
+        first = int(options['first'])
+        records = (r for i, r in enumerate(records) if i < first)
+
+    for record in records:
+        print(format_record(record))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
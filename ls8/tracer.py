@@ -0,0 +1,170 @@
+"""
+Binary tracing for the CPU.
+
+A Tracer attached as cpu.monitor records one fixed-size binary record per
+instruction, holding the state CPU.trace() would print before the
+instruction runs: PC, the instruction and operand bytes, FL and the
+registers. Records go into a preallocated ring buffer that keeps the most
+recent ones. With a file, the buffer is written out each time it fills
+instead, so every record is kept.
+
+Tracing can stop on a trigger: reaching a PC or executing an opcode.
+
+Trace files start with a header (magic, version, record size) followed by
+records in order. tracedump.py turns them back into TRACE text.
+"""
+
+import struct
+
+from cpu import FOREVER, IDLE, MAX_STEPS, UNTIL_PC, Halt, Pending
+
+TRACE_MAGIC = b'LS8T'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sBB')
+
+# pc, ir, operand_a, operand_b, fl, r0-r7
+RECORD = struct.Struct('<BBBBB8s')
+
+# Why the tracer stopped, when it was a trigger
+TRIGGERED = 'trigger'
+
+
+class Tracer:
+    """Records a binary trace of a CPU's execution."""
+
+    def __init__(self, capacity=1 << 16, file=None, stop_pc=None,
+                 stop_opcode=None):
+        """
+        Keep the last capacity records in memory, or, if file is given
+        (a path), stream every record to it. Stop the run when the PC
+        reaches stop_pc or an instruction with opcode stop_opcode is
+        about to execute.
+        """
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        # Records written so far, in total
+        self.count = 0
+        self.stop_pc = stop_pc
+        self.stop_opcode = stop_opcode
+        self.file = None
+        if file is not None:
+            self.file = open(file, 'wb')
+            self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+                                              RECORD.size))
+
+    def run(self, cpu, max_steps=None, until_pc=None):
+        """CPU.run, recording every instruction."""
+        decoded = cpu.decoded
+        ram = cpu.ram
+        reg = cpu.reg
+        buffer = self.buffer
+        pack_into = RECORD.pack_into
+        size = RECORD.size
+        end = len(buffer)
+        offset = (self.count % self.capacity) * size
+        stop_pc = self.stop_pc
+        stop_opcode = self.stop_opcode
+
+        interrupts = cpu.interrupts
+        limit = FOREVER if max_steps is None else max_steps
+        reason = MAX_STEPS
+        error = None
+        steps = 0
+
+        while steps < limit:
+            # Run in the same chunks as CPU.run, so interrupts are taken
+            # at the same points
+            chunk = limit - steps
+            if interrupts is not None:
+                chunk = min(chunk, interrupts.deadline - cpu.cycles)
+            count = 0
+
+            try:
+                for count in range(1, chunk + 1):
+                    pc = cpu.pc
+                    inst_reg = ram[pc]
+                    if pc == until_pc:
+                        reason = UNTIL_PC
+                        count -= 1
+                        break
+                    if pc == stop_pc or inst_reg == stop_opcode:
+                        reason = TRIGGERED
+                        count -= 1
+                        break
+
+                    handler, operand_a, operand_b, cpu.pc = decoded[pc]
+                    # The operand bytes as they are in RAM, as CPU.trace
+                    # shows them, not the decoded operands
+                    pack_into(buffer, offset, pc, inst_reg,
+                              ram[(pc + 1) & 0xff], ram[(pc + 2) & 0xff],
+                              cpu.fl, reg)
+                    offset += size
+                    if offset == end:
+                        if self.file is not None:
+                            self.file.write(buffer)
+                        offset = 0
+
+                    handler(cpu, operand_a, operand_b)
+            except Pending:
+                pass
+            except Halt as halt:
+                reason = halt.reason
+                error = halt.error
+
+            steps += count
+            cpu.cycles += count
+            if reason != MAX_STEPS:
+                break
+            if interrupts is not None:
+                interrupts.service()
+                if interrupts.waiting:
+                    reason = IDLE
+                    break
+
+        self.count += steps
+        return cpu.result(reason, steps, error)
+
+    def records(self):
+        """The buffered records, oldest first, as bytes."""
+        size = RECORD.size
+        if self.count <= self.capacity:
+            return bytes(self.buffer[:self.count * size])
+        split = (self.count % self.capacity) * size
+        return bytes(self.buffer[split:] + self.buffer[:split])
+
+    def save(self, path):
+        """Write the buffered records to a trace file."""
+        with open(path, 'wb') as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+                                      RECORD.size))
+            f.write(self.records())
+
+    def close(self):
+        """Write out whatever the file hasn't got yet."""
+        if self.file is not None:
+            used = (self.count % self.capacity) * RECORD.size
+            self.file.write(self.buffer[:used])
+            self.file.close()
+            self.file = None
+
+
+def read_trace(path):
+    """Yield (pc, ir, operand_a, operand_b, fl, regs) from a trace file."""
+    with open(path, 'rb') as f:
+        magic, version, size = TRACE_HEADER.unpack(
+            f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise Exception(f"{path} is not a version {TRACE_VERSION} "
+                            f"trace file")
+        data = f.read()
+
+    for offset in range(0, len(data) - size + 1, size):
+        yield RECORD.unpack_from(data, offset)
+
+
+def format_record(record):
+    """A record in the format CPU.trace() prints."""
+    pc, inst_reg, operand_a, operand_b, fl, regs = record
+    line = "TRACE: %02X | %02X %02X %02X |" % (pc, inst_reg, operand_a,
+                                               operand_b)
+    return line + "".join(" %02X" % r for r in regs)
@@ -0,0 +1,268 @@
+"""
+Basic-block translation engine.
+
+Instead of dispatching one instruction at a time, the translator finds the
+basic block starting at the current PC (a straight run of instructions
+ending at the first one that sets the PC or can stop the machine),
+generates Python source for the whole block, compiles it once and caches
+the resulting closure by entry address. Writes into a translated range
+throw the affected blocks away so self-modifying code keeps working.
+"""
+
+import sys
+
+from cpu import (ADD, AND, CALL, CMP, CPU, DEC, DIV, FL_E, FL_G, FL_L, HALTED,
+                 HLT, IDLE, INC, JEQ, JGE, JGT, JLE, JLT, JMP, JNE, LD, LDI,
+                 MAX_STEPS, MOD, MUL, NOP, NOT, OPERAND_MASKS, OR, POP, PRA,
+                 PRN, PUSH, RET, SHL, SHR, SP, ST, SUB, XOR, Halt,
+                 Pending)
+
+# Longest block we'll translate, in instructions
+MAX_BLOCK = 64
+
+# Python source templates for instructions the translator inlines. Each
+# template is formatted with a (operand_a), b (operand_b), pc (address of
+# the instruction) and next_pc. Opcodes that aren't listed here are
+# called through the CPU's own handlers. Instructions that set the PC do
+# it with a line starting "cpu.pc = ".
+TEMPLATES = {
+    NOP: [],
+    LDI: ["reg[{a}] = {b}"],
+    LD: ["reg[{a}] = ram[reg[{b}]]"],
+    ST: ["cpu.ram_write(reg[{a}], reg[{b}])"],
+    ADD: ["reg[{a}] = (reg[{a}] + reg[{b}]) & 0xff"],
+    SUB: ["reg[{a}] = (reg[{a}] - reg[{b}]) & 0xff"],
+    MUL: ["reg[{a}] = (reg[{a}] * reg[{b}]) & 0xff"],
+    AND: ["reg[{a}] &= reg[{b}]"],
+    OR: ["reg[{a}] |= reg[{b}]"],
+    XOR: ["reg[{a}] ^= reg[{b}]"],
+    SHL: ["reg[{a}] = (reg[{a}] << reg[{b}]) & 0xff"],
+    SHR: ["reg[{a}] >>= reg[{b}]"],
+    NOT: ["reg[{a}] ^= 0xff"],
+    INC: ["reg[{a}] = (reg[{a}] + 1) & 0xff"],
+    DEC: ["reg[{a}] = (reg[{a}] - 1) & 0xff"],
+    CMP: [f"cpu.fl = ({FL_L} if reg[{{a}}] < reg[{{b}}] else "
+          f"{FL_G} if reg[{{a}}] > reg[{{b}}] else {FL_E})"],
+    PRN: ["cpu.prn({a}, 0)"],
+    PRA: ["cpu.pra({a}, 0)"],
+    PUSH: [f"reg[{SP}] = (reg[{SP}] - 1) & 0xff",
+           f"cpu.ram_write(reg[{SP}], reg[{{a}}])"],
+    POP: [f"reg[{{a}}] = ram[reg[{SP}]]",
+          f"reg[{SP}] = (reg[{SP}] + 1) & 0xff"],
+    CALL: [f"reg[{SP}] = (reg[{SP}] - 1) & 0xff",
+           f"cpu.ram_write(reg[{SP}], ({{pc}} + 2) & 0xff)",
+           "cpu.pc = reg[{a}]"],
+    RET: [f"cpu.pc = ram[reg[{SP}]]",
+          f"reg[{SP}] = (reg[{SP}] + 1) & 0xff"],
+    JMP: ["cpu.pc = reg[{a}]"],
+    JEQ: [f"cpu.pc = reg[{{a}}] if cpu.fl & {FL_E} else {{next_pc}}"],
+    JNE: [f"cpu.pc = {{next_pc}} if cpu.fl & {FL_E} else reg[{{a}}]"],
+    JGT: [f"cpu.pc = reg[{{a}}] if cpu.fl & {FL_G} else {{next_pc}}"],
+    JLT: [f"cpu.pc = reg[{{a}}] if cpu.fl & {FL_L} else {{next_pc}}"],
+    JGE: [f"cpu.pc = reg[{{a}}] if cpu.fl & {FL_G | FL_E} else "
+          "{next_pc}"],
+    JLE: [f"cpu.pc = reg[{{a}}] if cpu.fl & {FL_L | FL_E} else "
+          "{next_pc}"],
+}
+
+# Inlined instructions that write RAM and so may invalidate blocks
+WRITES = {ST, PUSH, CALL}
+
+# Instructions that can stop the machine. They end their block, so a
+# block that stops has always run all of its instructions.
+STOPS = {HLT, DIV, MOD}
+
+
+def find_block(ram, entry):
+    """
+    Decode the basic block starting at entry. Returns a list of
+    (pc, inst_reg, operand_a, operand_b, next_pc) tuples.
+    """
+    insts = []
+    pc = entry
+
+    while len(insts) < MAX_BLOCK:
+        inst_reg = ram[pc]
+        inst_size = ((inst_reg >> 6) & 0b11) + 1
+        next_pc = pc + inst_size
+        mask_a, mask_b = OPERAND_MASKS[inst_reg]
+        insts.append((pc, inst_reg, ram[(pc + 1) & 0xff] & mask_a,
+                      ram[(pc + 2) & 0xff] & mask_b, next_pc))
+
+        # Block ends at anything that sets the PC, and at anything that
+        # can stop the machine
+        if (inst_reg & 0b00010000 or inst_reg in STOPS or
+                CPU.branchtable[inst_reg] is CPU.trap):
+            break
+
+        # Don't run off the top of RAM
+        if next_pc > 0xff:
+            break
+
+        pc = next_pc
+
+    return insts
+
+
+class Block:
+    """A translated basic block."""
+
+    def __init__(self, entry, end, steps, source, run):
+        self.entry = entry
+        # Address just past the last byte of the block
+        self.end = end
+        # Number of instructions in the block
+        self.steps = steps
+        self.source = source
+        self.run = run
+
+
+class Translator:
+    """Runs a CPU by translating its program into Python basic blocks."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # Translated block for each entry address
+        self.blocks = [None] * 256
+        # Entry addresses of the blocks covering each RAM byte
+        self.covering = [set() for _ in range(256)]
+        # Set when a write invalidates a block; checked by generated code
+        # after every instruction that can write RAM
+        self.dirty = False
+        cpu.invalidate_hooks.append(self.invalidate)
+
+    def invalidate(self, address):
+        """Throw away every block covering address."""
+        for entry in list(self.covering[address]):
+            block = self.blocks[entry]
+            self.blocks[entry] = None
+            for i in range(block.entry, block.end):
+                self.covering[i & 0xff].discard(entry)
+            self.dirty = True
+
+    def generate(self, entry, insts):
+        """
+        Generate Python source for a block of decoded instructions. The
+        block function returns the number of instructions it executed.
+        """
+        lines = [
+            "def make(cpu, tr, handlers):",
+            "    reg = cpu.reg",
+            "    ram = cpu.ram",
+            f"    def block_{entry:02x}():",
+        ]
+        body = []
+
+        for count, (pc, inst_reg, operand_a, operand_b, next_pc) in \
+                enumerate(insts, 1):
+            sets_pc = inst_reg & 0b00010000
+            fields = {'a': operand_a, 'b': operand_b, 'pc': pc,
+                      'next_pc': next_pc & 0xff}
+
+            if inst_reg in TEMPLATES:
+                body += [t.format(**fields) for t in TEMPLATES[inst_reg]]
+                writes = inst_reg in WRITES
+            elif CPU.branchtable[inst_reg] is CPU.trap:
+                # Decoded as the interpreter does: the trap reports the
+                # address and opcode
+                body.append(f"cpu.pc = {pc}")
+                body.append(f"handlers[{inst_reg}](cpu, {pc}, {inst_reg})")
+                writes = False
+            else:
+                # Handlers expect the PC to be advanced already, just as
+                # the interpreter does
+                body.append(f"cpu.pc = {pc if sets_pc else next_pc & 0xff}")
+                body.append(f"handlers[{inst_reg}](cpu, {operand_a}, "
+                            f"{operand_b})")
+                writes = True
+
+            if writes and sets_pc:
+                # The block is over anyway
+                body.append("tr.dirty = False")
+            elif writes:
+                # If this wrote over translated code, the rest of the block
+                # may be stale
+                body += ["if tr.dirty:",
+                         "    tr.dirty = False",
+                         f"    cpu.pc = {next_pc & 0xff}",
+                         f"    return {count}"]
+
+        # Fell off the end without anything setting the PC
+        last_pc, last_inst, _, _, last_next = insts[-1]
+        if not last_inst & 0b00010000:
+            body.append(f"cpu.pc = {last_next & 0xff}")
+        body.append(f"return {len(insts)}")
+
+        lines += ["        " + line for line in body]
+        lines.append(f"    return block_{entry:02x}")
+        return "\n".join(lines) + "\n"
+
+    def translate(self, entry):
+        """Translate, compile and cache the block starting at entry."""
+        insts = find_block(self.cpu.ram, entry)
+        source = self.generate(entry, insts)
+
+        namespace = {}
+        exec(compile(source, f"<ls8 block {entry:02x}>", "exec"), namespace)
+        run = namespace['make'](self.cpu, self, self.cpu.branchtable)
+
+        end = insts[-1][4]
+        block = Block(entry, end, len(insts), source, run)
+        self.blocks[entry] = block
+
+        for i in range(entry, end):
+            self.covering[i & 0xff].add(entry)
+            self.cpu.code[i & 0xff] = 1
+
+        return block
+
+    def run(self, max_steps=None):
+        """
+        Run the CPU through translated blocks. With max_steps, stop at the
+        first block boundary after that many instructions. Returns a
+        RunResult, as CPU.run does.
+        """
+        cpu = self.cpu
+        if cpu.halted:
+            return cpu.result(HALTED, 0)
+
+        blocks = self.blocks
+        interrupts = cpu.interrupts
+        limit = sys.maxsize if max_steps is None else max_steps
+        start = cpu.cycles
+        steps = 0
+
+        # Interrupts are only looked for between blocks, once the cycle
+        # count has reached the controller's deadline
+        deadline = sys.maxsize
+        if interrupts is not None:
+            deadline = interrupts.deadline - start
+
+        while steps < limit:
+            block = blocks[cpu.pc]
+            if block is None:
+                block = self.translate(cpu.pc)
+
+            try:
+                steps += block.run()
+            except Pending:
+                # INT and IRET end their blocks
+                steps += block.steps
+                deadline = steps
+            except Halt as halt:
+                # Anything that stops the machine ends its block
+                steps += block.steps
+                cpu.cycles = start + steps
+                return cpu.result(halt.reason, steps, halt.error)
+
+            if steps >= deadline:
+                cpu.cycles = start + steps
+                interrupts.service()
+                if interrupts.waiting:
+                    return cpu.result(IDLE, steps)
+                # Idling moves the cycle count on by itself
+                start = cpu.cycles - steps
+                deadline = interrupts.deadline - start
+
+        cpu.cycles = start + steps
+        return cpu.result(MAX_STEPS, steps)